@@ -3,6 +3,7 @@ from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
 import os
+import gc
 import datetime
 
 # Load environment variables from .env file
@@ -15,6 +16,10 @@ bcrypt = Bcrypt()
 def create_app():
     app = Flask(__name__)
 
+    # Encode ObjectId/datetime directly (with orjson when installed) instead of per-handler formatting
+    from .json_provider import MongoJSONProvider
+    app.json = MongoJSONProvider(app)
+
     # Load JWT secret key from .env file
     jwt_secret_key = os.getenv("JWT_SECRET_KEY")
 
@@ -29,6 +34,18 @@ def create_app():
     jwt.init_app(app)
     bcrypt.init_app(app)
 
+    # Request/Mongo instrumentation, registered before the blueprints create their MongoClients
+    from . import metrics
+    metrics.init_app(app)
+
+    # gzip/brotli compression of large responses
+    from . import compression
+    compression.init_app(app)
+
+    # Background job workers, started in each worker process on its first request
+    from . import jobs
+    jobs.init_app(app)
+
     # Register Blueprints
     from .auth import auth_bp
     from .cart import cart_bp
@@ -38,6 +55,8 @@ def create_app():
     from .transaction import transactions_bp
     from .user import user_bp
     from .wishlist import wishlist_bp
+    from .metrics import metrics_bp
+    from .analytics import analytics_bp
 
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(cart_bp, url_prefix='/cart')
@@ -47,5 +66,24 @@ def create_app():
     app.register_blueprint(transactions_bp, url_prefix='/transaction')
     app.register_blueprint(user_bp, url_prefix='/user')
     app.register_blueprint(wishlist_bp, url_prefix='/wishlist')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
+
+    # Make sure the indexes the queries rely on exist
+    if os.getenv("CREATE_INDEXES", "true").lower() == "true":
+        from .indexes import ensure_indexes
+
+        ensure_indexes()
+
+    # Optionally load the prediction model in the master process (e.g. gunicorn --preload)
+    # so forked workers share the model pages copy-on-write instead of each loading a copy
+    if os.getenv("PRELOAD_MODEL", "false").lower() == "true":
+        from .model import load_model
+
+        load_model()
+
+        # Move loaded objects out of the GC's tracked generations so collections in
+        # the workers don't touch (and copy) the shared pages
+        gc.freeze()
 
     return app
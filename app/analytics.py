@@ -0,0 +1,353 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from pymongo import MongoClient, UpdateOne, DESCENDING
+from bson.objectid import ObjectId
+from functools import wraps
+from dotenv import load_dotenv
+from . import jobs, unit_of_work
+import os
+import sys
+import datetime
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+users = db["users"]
+transactions = db["transactions"]
+products = db["products"]
+
+# Materialized rollups, updated on every checkout and recomputed periodically
+sales_daily = db["sales_daily"]            # _id: "YYYY-MM-DD"
+sales_products = db["sales_products"]      # _id: product_id
+sales_attributes = db["sales_attributes"]  # _id: {"dimension": "shape"|"material", "value": ...}
+# Rollup steps applied per transaction (_id: transaction_id), expire after SALES_RECORDED_TTL seconds
+sales_recorded = db["sales_recorded"]
+# {"_id": "sales_rollups", "watermark": date, "run": id} of the last recompute: transactions dated
+# before the watermark are covered by it, later ones are also counted under after.<run> in each rollup
+metadata = db["metadata"]
+SALES_RECORDED_TTL = int(os.getenv("SALES_RECORDED_TTL", 7 * 86400))
+
+ATTRIBUTE_DIMENSIONS = ("shape", "material")
+
+# Create a Blueprint for analytics
+analytics_bp = Blueprint('analytics', __name__)
+
+# Role check decorator
+def role_required(role):
+    def wrapper(fn):
+        @wraps(fn)
+        @jwt_required()
+        def decorated_function(*args, **kwargs):
+            current_user = get_jwt_identity()
+            user = users.find_one({"_id": ObjectId(current_user)}, {"role": 1})
+            
+            if not user:
+                return jsonify({"error": "User not found"}), 404
+
+            if user.get("role") != role:
+                return jsonify({"error": "Access forbidden: Insufficient permissions"}), 403
+
+            return fn(*args, **kwargs)
+        return decorated_function
+    return wrapper
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+# Naive UTC datetime (as Mongo returns them) of a transaction date, None for legacy ISO strings
+def _utc(date):
+    if not isinstance(date, datetime.datetime):
+        return None
+    return date.astimezone(datetime.timezone.utc).replace(tzinfo=None) if date.tzinfo else date
+
+# Add one transaction to the rollups; order_products are the product documents of its items.
+# Each rollup is a step marked done in sales_recorded (keyed by transaction) once applied, so a retried
+# job skips what an earlier attempt already counted. With MONGO_TRANSACTIONS=true the steps and their
+# marks commit together; without it a step interrupted halfway can still be counted twice (the periodic
+# recompute repairs it). Transactions before the last recompute's watermark are already in the rollups
+# and skipped. Errors propagate so the job is retried.
+def record_transaction(transaction_id, transaction_items, order_products, date):
+    day = date.isoformat()[:10] if hasattr(date, "isoformat") else str(date)[:10]
+    total_amount = sum(item["price"] * item["quantity"] for item in transaction_items)
+    units = sum(item["quantity"] for item in transaction_items)
+
+    def write(session):
+        rollups = metadata.find_one({"_id": "sales_rollups"}, session=session) or {}
+        if rollups.get("watermark") and (_utc(date) is None or _utc(date) < rollups["watermark"]):
+            return
+
+        # Counted twice while a recompute runs: in the totals and in after.<run>, which the recompute
+        # adds to what it aggregated (it only covers transactions before its watermark)
+        def inc(values):
+            if rollups.get("run"):
+                values = {**values, **{f"after.{rollups['run']}.{field}": value for field, value in values.items()}}
+            return {"$inc": values}
+
+        product_updates = []
+        attribute_updates = []
+
+        for item, product in zip(transaction_items, order_products):
+            revenue = item["price"] * item["quantity"]
+
+            product_updates.append(UpdateOne(
+                {"_id": item["product_id"]},
+                {**inc({"units": item["quantity"], "revenue": revenue}), "$set": {"name": product.get("name")}},
+                upsert=True
+            ))
+
+            for dimension in ATTRIBUTE_DIMENSIONS:
+                for value in _as_list(product.get(dimension)):
+                    attribute_updates.append(UpdateOne(
+                        {"_id": {"dimension": dimension, "value": value}},
+                        inc({"units": item["quantity"], "revenue": revenue}),
+                        upsert=True
+                    ))
+
+        steps = {
+            "daily": lambda: sales_daily.update_one(
+                {"_id": day},
+                inc({"revenue": total_amount, "orders": 1, "units": units}),
+                upsert=True,
+                session=session
+            )
+        }
+        if product_updates:
+            steps["products"] = lambda: sales_products.bulk_write(product_updates, ordered=False, session=session)
+        if attribute_updates:
+            steps["attributes"] = lambda: sales_attributes.bulk_write(attribute_updates, ordered=False, session=session)
+
+        recorded = sales_recorded.find_one({"_id": transaction_id}, session=session) or {}
+
+        for step, apply in steps.items():
+            if step in recorded.get("steps", []):
+                continue
+
+            apply()
+            sales_recorded.update_one(
+                {"_id": transaction_id},
+                {"$addToSet": {"steps": step}, "$setOnInsert": {"recorded_at": datetime.datetime.now(datetime.timezone.utc)}},
+                upsert=True,
+                session=session
+            )
+
+    unit_of_work.run(client, write)
+
+# record_sales job: add a placed transaction to the rollups, off the checkout request
+def record_sales(transaction_id):
+    transaction = transactions.find_one({"_id": transaction_id}, {"items": 1, "date": 1})
+    if not transaction:
+        return
+
+    product_ids = [item["product_id"] for item in transaction["items"]]
+    found = {product["_id"]: product for product in products.find({"_id": {"$in": product_ids}}, {"name": 1, **{dimension: 1 for dimension in ATTRIBUTE_DIMENSIONS}})}
+    record_transaction(transaction_id, transaction["items"], [found.get(product_id, {}) for product_id in product_ids], transaction["date"])
+
+# Day of a transaction, whether "date" is an ISO string or a BSON date
+DAY_EXPRESSION = {
+    "$cond": [
+        {"$eq": [{"$type": "$date"}, "string"]},
+        {"$substrCP": ["$date", 0, 10]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+    ]
+}
+
+# Summed fields of each rollup
+ROLLUP_FIELDS = {
+    "sales_daily": ("revenue", "orders", "units"),
+    "sales_products": ("units", "revenue"),
+    "sales_attributes": ("units", "revenue")
+}
+
+def _daily_stages():
+    return [
+        {"$group": {
+            "_id": DAY_EXPRESSION,
+            "revenue": {"$sum": "$total_amount"},
+            "orders": {"$sum": 1},
+            "units": {"$sum": {"$sum": "$items.quantity"}}
+        }}
+    ]
+
+def _product_stages():
+    return [
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$items.product_id",
+            "units": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}}
+        }}
+    ]
+
+def _attribute_stages(dimension):
+    return [
+        {"$unwind": "$items"},
+        {"$lookup": {
+            "from": "products",
+            "localField": "items.product_id",
+            "foreignField": "_id",
+            "as": "product",
+            "pipeline": [{"$project": {dimension: 1}}]
+        }},
+        {"$unwind": "$product"},
+        {"$unwind": f"$product.{dimension}"},
+        {"$group": {
+            "_id": {"dimension": dimension, "value": f"$product.{dimension}"},
+            "units": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}}
+        }}
+    ]
+
+# Add the totals of archived transactions (see fold_archived) to the grouped rollup rows
+def _with_archived(stages, rollup, match=None):
+    fields = ROLLUP_FIELDS[rollup]
+
+    return stages + [
+        {"$unionWith": {"coll": f"{rollup}_archived", "pipeline": ([{"$match": match}] if match else []) + [
+            {"$project": {"_id": "$_id.key", **{field: 1 for field in fields}}}
+        ]}},
+        {"$group": {"_id": "$_id", **{field: {"$sum": f"${field}"} for field in fields}}}
+    ]
+
+def _merge(into):
+    return {"$merge": {"into": into, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+
+# Only transactions before the watermark (legacy string dates are older than any)
+def _before(watermark):
+    return {"$match": {"$or": [{"date": {"$lt": watermark}}, {"date": {"$type": "string"}}]}}
+
+# Merge recomputed rows into the live rollup: the totals become the recomputed ones plus what was
+# recorded for later transactions during this run (after.<run>), in one atomic update per document
+def _merge_recomputed(rollup, run):
+    sums = {field: {"$add": [f"$$new.{field}", {"$ifNull": [f"$after.{run}.{field}", 0]}]} for field in ROLLUP_FIELDS[rollup]}
+
+    return [
+        {"$set": {"recomputed": run}},
+        {"$merge": {
+            "into": rollup,
+            "on": "_id",
+            "whenMatched": [{"$replaceWith": {"$mergeObjects": ["$$new", sums, {"after": {run: f"$after.{run}"}}]}}],
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+# Rebuild every rollup from the transactions collection (plus archived totals). Transactions from
+# now on are recorded both into the totals and into after.<run>; everything before the watermark is
+# aggregated and merged into the live rollups together with those increments, then rows the
+# aggregation didn't produce keep only their after.<run> part (or go, if they have none). Checkouts
+# keep recording meanwhile; run one recompute at a time.
+def recompute_rollups():
+    run = str(ObjectId())
+    watermark = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    metadata.update_one({"_id": "sales_rollups"}, {"$set": {"watermark": watermark, "run": run}}, upsert=True)
+
+    transactions.aggregate([_before(watermark)] + _with_archived(_daily_stages(), "sales_daily") + _merge_recomputed("sales_daily", run))
+
+    transactions.aggregate([_before(watermark)] + _with_archived(_product_stages(), "sales_products") + [
+        {"$lookup": {
+            "from": "products",
+            "localField": "_id",
+            "foreignField": "_id",
+            "as": "product",
+            "pipeline": [{"$project": {"name": 1}}]
+        }},
+        {"$set": {"name": {"$first": "$product.name"}}},
+        {"$unset": "product"}
+    ] + _merge_recomputed("sales_products", run))
+
+    for dimension in ATTRIBUTE_DIMENSIONS:
+        transactions.aggregate(
+            [_before(watermark)]
+            + _with_archived(_attribute_stages(dimension), "sales_attributes", {"_id.key.dimension": dimension})
+            + _merge_recomputed("sales_attributes", run)
+        )
+
+    for rollup, fields in ROLLUP_FIELDS.items():
+        stale = {"recomputed": {"$ne": run}}
+        db[rollup].update_many({**stale, f"after.{run}": {"$exists": True}}, [{"$set": {
+            **{field: {"$ifNull": [f"$after.{run}.{field}", 0]} for field in fields},
+            "after": {run: f"$after.{run}"},
+            "recomputed": run
+        }}])
+        db[rollup].delete_many({**stale, f"after.{run}": {"$exists": False}})
+
+# Keep the totals of transactions about to leave the collection (archive.py), one document per
+# (segment, rollup key) so folding the same segment again replaces instead of double counting
+def fold_archived(transaction_ids, segment):
+    match = {"$match": {"_id": {"$in": transaction_ids}}}
+    pipelines = [("sales_daily", _daily_stages())] + [("sales_products", _product_stages())] + [
+        ("sales_attributes", _attribute_stages(dimension)) for dimension in ATTRIBUTE_DIMENSIONS
+    ]
+
+    for rollup, stages in pipelines:
+        transactions.aggregate([match] + stages + [
+            {"$set": {"_id": {"segment": segment, "key": "$_id"}}},
+            _merge(f"{rollup}_archived")
+        ])
+
+# Revenue, orders and units per day (?from=YYYY-MM-DD&to=YYYY-MM-DD)
+@analytics_bp.route("/revenue", methods=["GET"])
+@role_required("admin")
+def get_revenue_by_day():
+    query = {}
+    if request.args.get("from"):
+        query.setdefault("_id", {})["$gte"] = request.args["from"]
+    if request.args.get("to"):
+        query.setdefault("_id", {})["$lte"] = request.args["to"]
+
+    days = [
+        {"date": day["_id"], "revenue": day.get("revenue", 0), "orders": day.get("orders", 0), "units": day.get("units", 0)}
+        for day in sales_daily.find(query).sort("_id", 1)
+    ]
+    return jsonify(days), 200
+
+# Best selling products (?by=units|revenue&limit=10)
+@analytics_bp.route("/top-products", methods=["GET"])
+@role_required("admin")
+def get_top_products():
+    sort_by = request.args.get("by", "units")
+    if sort_by not in ("units", "revenue"):
+        return jsonify({"error": "'by' must be units or revenue"}), 400
+
+    limit = int(request.args.get("limit", 10))
+    top_products = [
+        {"product_id": product["_id"], "name": product.get("name"), "units": product.get("units", 0), "revenue": product.get("revenue", 0)}
+        for product in sales_products.find().sort(sort_by, DESCENDING).limit(limit)
+    ]
+    return jsonify(top_products), 200
+
+# Units and revenue per frame shape or material (?dimension=shape|material)
+@analytics_bp.route("/units", methods=["GET"])
+@role_required("admin")
+def get_units_by_attribute():
+    dimension = request.args.get("dimension", "shape")
+    if dimension not in ATTRIBUTE_DIMENSIONS:
+        return jsonify({"error": f"'dimension' must be one of: {', '.join(ATTRIBUTE_DIMENSIONS)}"}), 400
+
+    buckets = [
+        {dimension: bucket["_id"]["value"], "units": bucket.get("units", 0), "revenue": bucket.get("revenue", 0)}
+        for bucket in sales_attributes.find({"_id.dimension": dimension}).sort("units", DESCENDING)
+    ]
+    return jsonify(buckets), 200
+
+# Rebuild the rollups now (normally run periodically, see below)
+@analytics_bp.route("/recompute", methods=["POST"])
+@role_required("admin")
+def recompute():
+    # Full aggregation over every transaction, run by a job worker
+    job_id = jobs.enqueue("recompute_rollups")
+    if job_id is None:
+        return jsonify({"message": "Rollups recomputed"}), 200
+    return jsonify({"message": "Rollup recompute queued", "job_id": str(job_id)}), 202
+
+# Periodic recompute, e.g. from cron: python -m app.analytics recompute
+if __name__ == "__main__":
+    if sys.argv[1:] == ["recompute"]:
+        recompute_rollups()
+        print("Rollups recomputed.")
+    else:
+        print("Usage: python -m app.analytics recompute")
@@ -0,0 +1,261 @@
+from pymongo import MongoClient
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from . import analytics
+import os
+import sys
+import gzip
+import json
+import datetime
+import functools
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+transactions = db["transactions"]
+
+# Transactions older than this move from Mongo to NDJSON.gz segments in ARCHIVE_DIR
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 365))
+ARCHIVE_SEGMENT_SIZE = int(os.getenv("ARCHIVE_SEGMENT_SIZE", 50000))
+
+# Ids deleted from Mongo per delete_many
+DELETE_BATCH_SIZE = 5000
+
+# manifest.json lists the segments in date order:
+# {"file", "count", "first_date", "last_date", "state": "written" | "folded" | "archived"}
+# Only "archived" segments are read back, the others are still in Mongo (an interrupted run).
+# Next to each segment, <file>.users.json maps user_id -> {"count", "total_amount"} so per-user pages
+# and totals only open the segments they need.
+def _manifest_path():
+    return os.path.join(ARCHIVE_DIR, "manifest.json")
+
+def load_manifest():
+    try:
+        with open(_manifest_path()) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {"segments": []}
+
+# Replace the manifest atomically, a crash leaves the old or the new one
+def _save_manifest(manifest):
+    path = _manifest_path()
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(path + ".tmp", path)
+
+def _encode(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't archive {type(value).__name__}")
+
+def _users_path(name):
+    return os.path.join(ARCHIVE_DIR, name + ".users.json")
+
+def _write_user_index(name, rows):
+    users = {}
+    for row in rows:
+        totals = users.setdefault(str(row.get("user_id")), {"count": 0, "total_amount": 0})
+        totals["count"] += 1
+        totals["total_amount"] += row.get("total_amount", 0)
+
+    path = _users_path(name)
+    with open(path + ".tmp", "w") as users_file:
+        json.dump(users, users_file)
+    os.replace(path + ".tmp", path)
+    return users
+
+def _write_segment(name, batch):
+    path = os.path.join(ARCHIVE_DIR, name)
+
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as segment_file:
+        for transaction in batch:
+            segment_file.write(json.dumps(transaction, default=_encode) + "\n")
+    os.replace(path + ".tmp", path)
+    _write_user_index(name, batch)
+
+# Per-user counts and totals of an archived segment (segments don't change once archived);
+# built from the segment for ones archived before the index existed
+@functools.lru_cache(maxsize=256)
+def _user_index(name):
+    try:
+        with open(_users_path(name)) as users_file:
+            return json.load(users_file)
+    except FileNotFoundError:
+        return _write_user_index(name, _read_segment(name))
+
+# Stream the rows of a segment
+def _read_segment(name):
+    with gzip.open(os.path.join(ARCHIVE_DIR, name), "rt", encoding="utf-8") as segment_file:
+        for line in segment_file:
+            yield json.loads(line)
+
+# Fold the segment's transactions into the archived rollup totals, then delete them from Mongo.
+# Each step is recorded in the manifest so an interrupted run resumes where it stopped.
+def _finish_segment(manifest, segment):
+    ids = [ObjectId(row["_id"]) for row in _read_segment(segment["file"])]
+
+    if segment["state"] == "written":
+        analytics.fold_archived(ids, segment["file"])
+        segment["state"] = "folded"
+        _save_manifest(manifest)
+
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        transactions.delete_many({"_id": {"$in": ids[start:start + DELETE_BATCH_SIZE]}})
+
+    segment["state"] = "archived"
+    _save_manifest(manifest)
+
+# Move transactions older than ARCHIVE_AFTER_DAYS to segments (dates must be BSON dates,
+# see `python -m app.migrations transaction-dates`); returns the number of archived transactions
+def archive_transactions():
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    manifest = load_manifest()
+    archived = 0
+
+    for segment in manifest["segments"]:
+        if segment["state"] != "archived":
+            _finish_segment(manifest, segment)
+
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+
+    while True:
+        batch = list(transactions.find({"date": {"$lt": cutoff}}).sort([("date", 1), ("_id", 1)]).limit(ARCHIVE_SEGMENT_SIZE))
+        if not batch:
+            break
+
+        segment = {
+            "file": f"transactions-{batch[0]['date']:%Y%m%d}-{batch[0]['_id']}.ndjson.gz",
+            "count": len(batch),
+            "first_date": batch[0]["date"].isoformat(),
+            "last_date": batch[-1]["date"].isoformat(),
+            "state": "written"
+        }
+
+        _write_segment(segment["file"], batch)
+        manifest["segments"].append(segment)
+        _save_manifest(manifest)
+        _finish_segment(manifest, segment)
+
+        archived += len(batch)
+        print(f"{archived} transactions archived", end="\r")
+
+    print(f"{archived} transactions archived")
+    return archived
+
+def _naive_utc(date):
+    return date.astimezone(datetime.timezone.utc).replace(tzinfo=None) if date.tzinfo else date
+
+def _in_range(date, date_query):
+    if not date_query:
+        return True
+
+    date = _naive_utc(date)
+    return (
+        ("$gte" not in date_query or date >= _naive_utc(date_query["$gte"]))
+        and ("$lt" not in date_query or date < _naive_utc(date_query["$lt"]))
+        and ("$lte" not in date_query or date <= _naive_utc(date_query["$lte"]))
+    )
+
+def _segment_dates(segment):
+    return datetime.datetime.fromisoformat(segment["first_date"]), datetime.datetime.fromisoformat(segment["last_date"])
+
+# Archived segments with transactions in the date query's range, oldest first
+def _segments(date_query):
+    segments = []
+
+    for segment in load_manifest()["segments"]:
+        first_date, last_date = _segment_dates(segment)
+        if segment["state"] == "archived" and _in_range(first_date, {
+            key: value for key, value in (date_query or {}).items() if key != "$gte"
+        }) and _in_range(last_date, {
+            key: value for key, value in (date_query or {}).items() if key == "$gte"
+        }):
+            segments.append(segment)
+
+    return segments
+
+# Every transaction of the segment is in the range, its user index answers for it
+def _covered(segment, date_query):
+    return all(_in_range(date, date_query) for date in _segment_dates(segment))
+
+# Matching rows of one segment, oldest first
+def _segment_rows(segment, user_id, date_query):
+    for row in _read_segment(segment["file"]):
+        if user_id is not None and row.get("user_id") != str(user_id):
+            continue
+
+        row["date"] = datetime.datetime.fromisoformat(row["date"])
+        if _in_range(row["date"], date_query):
+            yield row
+
+# Archived transactions matching a user and/or a date query ({"$gte", "$lt", "$lte"}), oldest first
+# or newest first; segments outside the date range aren't opened, the others are streamed.
+# Dates come back as datetimes, ids as strings.
+def iter_archived(user_id=None, date_query=None, newest_first=False):
+    segments = _segments(date_query)
+
+    for segment in reversed(segments) if newest_first else segments:
+        if newest_first:
+            # Segments are written oldest first, a segment's matches are reversed in memory
+            yield from reversed(list(_segment_rows(segment, user_id, date_query)))
+        else:
+            yield from _segment_rows(segment, user_id, date_query)
+
+# Number and total amount of a user's archived transactions; only segments partly inside the date
+# range are read, the others are counted from their user index
+def archived_totals(user_id, date_query=None):
+    count = 0
+    total_amount = 0
+
+    for segment in _segments(date_query):
+        if _covered(segment, date_query):
+            totals = _user_index(segment["file"]).get(str(user_id))
+            if totals:
+                count += totals["count"]
+                total_amount += totals["total_amount"]
+        else:
+            for row in _segment_rows(segment, user_id, date_query):
+                count += 1
+                total_amount += row.get("total_amount", 0)
+
+    return count, total_amount
+
+# One page of a user's archived transactions, newest first: skips whole segments by their user
+# index and stops once the page is filled
+def archived_page(user_id, date_query, skip, limit):
+    page = []
+
+    for segment in reversed(_segments(date_query)):
+        if len(page) >= limit:
+            break
+
+        if _covered(segment, date_query):
+            count = _user_index(segment["file"]).get(str(user_id), {}).get("count", 0)
+            if skip >= count:
+                skip -= count
+                continue
+
+        rows = list(_segment_rows(segment, user_id, date_query))
+        if skip >= len(rows):
+            skip -= len(rows)
+            continue
+
+        page += rows[::-1][skip:skip + limit - len(page)]
+        skip = 0
+
+    return page
+
+# Periodic archival, e.g. from cron: python -m app.archive run
+if __name__ == "__main__":
+    if sys.argv[1:] == ["run"]:
+        archive_transactions()
+    else:
+        print("Usage: python -m app.archive run")
@@ -0,0 +1,65 @@
+from dotenv import load_dotenv
+from . import metrics
+import os
+import asyncio
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Run independent Mongo lookups concurrently on Motor (ASYNC_MONGO=true, needs the motor package)
+ASYNC_MONGO = os.getenv("ASYNC_MONGO", "false").lower() == "true"
+ASYNC_MONGO_TIMEOUT = float(os.getenv("ASYNC_MONGO_TIMEOUT", 30))
+
+# One event loop thread per process owns the Motor client; request threads hand it coroutines
+_loop = None
+_db = None
+_lock = threading.Lock()
+
+def _start():
+    global _loop, _db
+
+    with _lock:
+        if _loop is not None:
+            return
+
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="async-mongo", daemon=True).start()
+
+        # The client must be created on the loop it will be used from
+        async def connect():
+            client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+            return client[os.getenv("MONGO_DB_NAME")]
+
+        _db = asyncio.run_coroutine_threadsafe(connect(), loop).result()
+        _loop = loop
+
+# Async collection handle, only use it inside coroutines passed to run()
+def collection(name):
+    return _db[name]
+
+# Run coroutine_function(*args) on the Mongo event loop and wait for its result
+def run(coroutine_function, *args):
+    if _loop is None:
+        _start()
+
+    # Count the Motor commands in the calling request's metrics, tasks gathered inside inherit the context
+    commands = metrics.current_commands()
+
+    async def attributed():
+        metrics.request_commands.set(commands)
+        return await coroutine_function(*args)
+
+    return asyncio.run_coroutine_threadsafe(attributed(), _loop).result(ASYNC_MONGO_TIMEOUT)
+
+# A loop started in the master must not be reused by forked workers
+def _reset_after_fork():
+    global _loop, _db, _lock
+
+    _loop = None
+    _db = None
+    _lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
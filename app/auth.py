@@ -40,6 +40,8 @@ def format_user(user):
         print(f"Error formatting user: {str(e)}")
         return None  # Return None or handle the error as needed
 
+# Fields read on login/register, format_user's fields and the password hash
+AUTH_USER_PROJECTION = {"name": 1, "email": 1, "role": 1, "photo_profile": 1, "password": 1}
 
 # Create new user
 @auth_bp.route("/register", methods=["POST"])
@@ -54,7 +56,7 @@ def register():
     role = data.get("role", "user")
     password = bcrypt.generate_password_hash(data["password"]).decode('utf-8')
 
-    if users.find_one({"email": email}):
+    if users.find_one({"email": email}, {"_id": 1}):
         return jsonify({"message": "Email sudah terdaftar"}), 409
 
     user_id = users.insert_one({
@@ -66,7 +68,7 @@ def register():
     
     access_token = create_access_token(identity=str(user_id))
     
-    user = users.find_one({"email": email})
+    user = users.find_one({"email": email}, AUTH_USER_PROJECTION)
 
     return jsonify({"message": "Berhasil register", "access_token": access_token, "user": format_user(user)}), 201
 
@@ -81,7 +83,7 @@ def login():
     email = data["email"]
     password = data["password"]
 
-    user = users.find_one({"email": email})
+    user = users.find_one({"email": email}, AUTH_USER_PROJECTION)
 
     if user and bcrypt.check_password_hash(user["password"],password):
         access_token = create_access_token(identity=str(user["_id"]))
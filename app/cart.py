@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, UpdateOne, DeleteOne, errors
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
+from . import unit_of_work
 import os
+import datetime
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,20 +13,16 @@ load_dotenv()
 # Initialize MongoDB client
 client = MongoClient(os.getenv("MONGO_URI"))
 db = client[os.getenv("MONGO_DB_NAME")]
-users = db["users"]
 products = db["products"]
+# One document per (user_id, product_id, color), see indexes.py
+carts = db["carts"]
+
+# Fields returned for each cart item
+CART_ITEM_PROJECTION = {"_id": 0, "product_id": 1, "color": 1, "quantity": 1}
 
 # Create a Blueprint for cart
 cart_bp = Blueprint('cart', __name__)
 
-def format_user(user):
-    user["_id"] = str(user["_id"])
-
-    for product in user.get("cart", []):
-        product["product_id"] = str(product["product_id"])
-
-    return user
-
 # Add cart to user
 @cart_bp.route("/", methods=["POST"])
 @jwt_required()
@@ -39,11 +37,10 @@ def add_to_cart():
     color = data["color"]
 
     try:
-        product = products.find_one({"_id": ObjectId(product_id)})
+        product = products.find_one({"_id": ObjectId(product_id)}, {"color": 1})
     except errors.InvalidId:
         return jsonify({"error": "Invalid 'product_id' format."}), 400
 
-    product = products.find_one({"_id": ObjectId(product_id)})
     if not product:
         return jsonify({"error": "Product not found."}), 404
     
@@ -51,72 +48,124 @@ def add_to_cart():
     if color not in colors:
         return jsonify({"error": f"Invalid color. Available colors: {', '.join(colors)}"}), 400
 
-    user = users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        return jsonify({"error": "User not found."}), 404
-
     quantity = data.get("quantity", 1)
     if not isinstance(quantity, int) or quantity <= 0:
         return jsonify({"error": "'quantity' must be a positive integer."}), 400
 
-    cart = user.get("cart", [])
-    existing_item = next((item for item in cart if item["product_id"] == ObjectId(product_id) and item["color"] == color), None)
-
-    if existing_item:
+    # A single upsert adds the item or increments its quantity
+    key = {"user_id": ObjectId(user_id), "product_id": ObjectId(product_id), "color": color}
+    try:
         try:
-            users.update_one(
-                {"_id": ObjectId(user_id), "cart.product_id": ObjectId(product_id), "cart.color": color},
-                {"$inc": {"cart.$.quantity": quantity}}
+            result = carts.update_one(
+                key,
+                {"$inc": {"quantity": quantity}, "$setOnInsert": {"added_at": datetime.datetime.now(datetime.timezone.utc)}},
+                upsert=True
             )
-            return jsonify({"message": "Product quantity updated in cart."}), 200
-        except errors.PyMongoError as e:
-            return jsonify({"error": f"An error occurred while updating the cart: {str(e)}"}), 500
-    else:
+        except errors.DuplicateKeyError:
+            # A concurrent request inserted the same item first, increment that one
+            result = carts.update_one(key, {"$inc": {"quantity": quantity}})
+    except errors.PyMongoError as e:
+        return jsonify({"error": f"An error occurred while adding to cart: {str(e)}"}), 500
+
+    if result.upserted_id:
+        return jsonify({"message": "Product added to cart."}), 201
+
+    return jsonify({"message": "Product quantity updated in cart."}), 200
+
+# Set the quantity of many cart items at once, 0 removes an item. All-or-nothing only with
+# MONGO_TRANSACTIONS=true, otherwise the items before a failing one stay written
+# Body: {"items": [{"product_id": ..., "color": ..., "quantity": ...}, ...]}
+@cart_bp.route("/", methods=["PUT"])
+@jwt_required()
+def update_cart():
+    user_id = ObjectId(get_jwt_identity())
+    data = request.get_json()
+
+    if not data or not isinstance(data.get("items"), list) or not data["items"]:
+        return jsonify({"error": "'items' field must be provided as a non-empty list."}), 400
+
+    items = []
+    for item in data["items"]:
+        if not isinstance(item, dict) or not all(field in item for field in ("product_id", "color", "quantity")):
+            return jsonify({"error": "Each item must contain 'product_id', 'color' and 'quantity'."}), 400
+
         try:
-            users.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$push": {"cart": {"product_id": ObjectId(product_id), "color": color, "quantity": quantity}}}
-            )
-            return jsonify({"message": "Product added to cart."}), 201
-        except errors.PyMongoError as e:
-            return jsonify({"error": f"An error occurred while adding to cart: {str(e)}"}), 500
+            product_id = ObjectId(item["product_id"])
+        except (errors.InvalidId, TypeError):
+            return jsonify({"error": "Invalid 'product_id' format."}), 400
+
+        if not isinstance(item["quantity"], int) or item["quantity"] < 0:
+            return jsonify({"error": "'quantity' must be a non-negative integer."}), 400
+
+        items.append((product_id, item["color"], item["quantity"]))
+
+    # Validate every added product and color with one query before writing anything
+    added_ids = list({product_id for product_id, _, quantity in items if quantity})
+    colors = {product["_id"]: product.get("color", []) for product in products.find({"_id": {"$in": added_ids}}, {"color": 1})}
+
+    for product_id, color, quantity in items:
+        if not quantity:
+            continue
+        if product_id not in colors:
+            return jsonify({"error": f"Product with ID {product_id} not found."}), 404
+        if color not in colors[product_id]:
+            return jsonify({"error": f"Invalid color for product {product_id}. Available colors: {', '.join(colors[product_id])}"}), 400
+
+    added_at = datetime.datetime.now(datetime.timezone.utc)
+    operations = []
+    for product_id, color, quantity in items:
+        key = {"user_id": user_id, "product_id": product_id, "color": color}
+        if quantity:
+            operations.append(UpdateOne(key, {"$set": {"quantity": quantity}, "$setOnInsert": {"added_at": added_at}}, upsert=True))
+        else:
+            operations.append(DeleteOne(key))
+
+    # One bulk write, all-or-nothing when MONGO_TRANSACTIONS is on
+    def write(session):
+        return carts.bulk_write(operations, ordered=True, session=session)
+
+    try:
+        try:
+            result = unit_of_work.run(client, write)
+        except errors.BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            # A concurrent request inserted one of the items first; the writes only set quantities,
+            # so running them again updates it instead
+            result = unit_of_work.run(client, write)
+    except errors.PyMongoError as e:
+        return jsonify({"error": f"An error occurred while updating the cart: {str(e)}"}), 500
+
+    return jsonify({
+        "message": "Cart updated.",
+        "updated": result.upserted_count + result.modified_count,
+        "removed": result.deleted_count
+    }), 200
 
 # Get user cart
 @cart_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_user_cart():
     user_id = get_jwt_identity()
-    
-    user = users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        return jsonify({"error": "User not found."}), 404
-    
-    user_data = format_user(user)
-    
-    return jsonify(user_data["cart"]), 200
 
-# Remove product from cart
+    cart = list(carts.find({"user_id": ObjectId(user_id)}, CART_ITEM_PROJECTION).sort("added_at", 1))
+
+    return jsonify(cart), 200
+
+# Remove product from cart (every color of it)
 @cart_bp.route("/<product_id>", methods=["DELETE"])
 @jwt_required()
 def remove_from_cart(product_id):
     user_id = get_jwt_identity()
 
-    user = users.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        return jsonify({"error": "User not found."}), 404
-
-    cart = user.get("cart", [])
-    product_in_cart = next((item for item in cart if item["product_id"] == ObjectId(product_id)), None)
-
-    if not product_in_cart:
-        return jsonify({"error": "Product not found in cart."}), 404
-
     try:
-        users.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$pull": {"cart": {"product_id": ObjectId(product_id)}}}
-        )
-        return jsonify({"message": "Product removed from cart."}), 200
+        result = carts.delete_many({"user_id": ObjectId(user_id), "product_id": ObjectId(product_id)})
+    except errors.InvalidId:
+        return jsonify({"error": "Invalid 'product_id' format."}), 400
     except errors.PyMongoError as e:
         return jsonify({"error": f"An error occurred while removing from cart: {str(e)}"}), 500
-    
\ No newline at end of file
+
+    if not result.deleted_count:
+        return jsonify({"error": "Product not found in cart."}), 404
+
+    return jsonify({"message": "Product removed from cart."}), 200
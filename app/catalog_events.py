@@ -0,0 +1,68 @@
+from pymongo import MongoClient, errors
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from . import recommendation, leaderboard, catalog_snapshot, suggest, similar, http_cache
+import os
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+
+# In-process indexes kept in sync with product writes
+INDEXES = (recommendation, leaderboard, catalog_snapshot, suggest)
+# Indexes answering requests tagged with the catalog version, they track the version they reflect
+VERSIONED_INDEXES = (leaderboard, catalog_snapshot)
+
+# Changed products are read once with every index's fields
+projection = {}
+for index in INDEXES + (similar,):
+    projection.update(index.projection)
+
+def _notify(product_ids, created=0, removed=0):
+    product_ids = [ObjectId(product_id) for product_id in product_ids]
+    documents = list(products.find({"_id": {"$in": product_ids}}, projection)) if product_ids else []
+
+    recommendation.apply_changes(product_ids, documents)
+    leaderboard.apply_changes(product_ids, documents, created=created, removed=removed)
+    catalog_snapshot.apply_changes(product_ids, documents)
+    suggest.apply_changes(product_ids, documents)
+    # Neighbor lists are stored in Mongo and refreshed by a background job
+    try:
+        similar.apply_changes(product_ids, documents)
+    except errors.PyMongoError as e:
+        # The write is done, the next refresh or `python -m app.similar build` picks it up
+        print(f"Error queueing similar products refresh: {e}")
+
+    # Any product write changes the listings; indexes that were current before it now include it
+    catalog = http_cache.bump_catalog_version()
+    for index in VERSIONED_INDEXES:
+        index.catalog_bumped(catalog[0])
+    http_cache.remember_catalog_version(catalog)
+
+# New products were inserted
+def products_created(product_ids):
+    _notify(product_ids, created=len(product_ids))
+
+# Existing products were updated (fields, stock/sold, rating, ...)
+def products_changed(product_ids):
+    _notify(product_ids)
+
+# A product was deleted
+def product_removed(product_id):
+    _notify([product_id], removed=1)
+
+# Many products changed at once (e.g. an import), rebuild the indexes on next use instead
+def catalog_reloaded():
+    for index in INDEXES:
+        index.invalidate()
+
+    try:
+        similar.invalidate()
+    except errors.PyMongoError as e:
+        print(f"Error queueing similar products build: {e}")
+
+    http_cache.remember_catalog_version(http_cache.bump_catalog_version())
@@ -0,0 +1,425 @@
+from pymongo import MongoClient, errors
+from dotenv import load_dotenv
+from . import metrics, http_cache
+import numpy as np
+import os
+import re
+import time
+import datetime
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+
+# Answer search/latest/best-seller from an in-memory columnar copy of the catalog (CATALOG_ENGINE=memory)
+CATALOG_ENGINE = os.getenv("CATALOG_ENGINE", "mongo").lower()
+# How the copy follows Mongo: "changestream" (needs a replica set, falls back to polling) or "poll"
+CATALOG_REFRESH_MODE = os.getenv("CATALOG_REFRESH_MODE", "poll").lower()
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", 5))
+# Polling only sees updated_at changes, a periodic full reload also catches deletes and external writes
+CATALOG_FULL_RELOAD_SECONDS = float(os.getenv("CATALOG_FULL_RELOAD_SECONDS", 600))
+
+NUMBER_FIELDS = ("price", "sold", "rating", "created_at")
+BITMAP_FIELDS = ("shape", "rim", "size", "weight", "material", "features")
+LISTING_FIELDS = ("_id", "name", "price", "sold", "review_count", "rating", "created_at", "images")
+
+# Fields read for each product: the listing document plus the filterable attributes
+projection = {
+    "_id": 1,
+    "name": 1,
+    "price": 1,
+    "sold": 1,
+    "review_count": {"$size": "$reviews"},
+    "rating": 1,
+    "images": {"$slice": [{"$ifNull": ["$images", []]}, 1]},
+    "created_at": 1,
+    "updated_at": 1,
+    "version": 1,
+    **{field: 1 for field in BITMAP_FIELDS}
+}
+
+def _number(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+def _values(value):
+    if value is None:
+        return []
+    return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+
+# Column arrays and per-value bitmaps over rows; deleted rows are masked out until the next full reload
+class CatalogSnapshot:
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.rows = {}
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Product ids as strings (same order as ObjectIds), the tie-break of every sort like in Mongo
+        self.ids = np.zeros(capacity, dtype="U24")
+        self.columns = {field: np.full(capacity, np.nan) for field in NUMBER_FIELDS}
+        self.bitmaps = {field: {} for field in BITMAP_FIELDS}
+        self.row_values = []
+        self.names = []
+        self.documents = []
+
+    def _grow(self):
+        extra = len(self.alive)
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=self.ids.dtype)])
+
+        for field, column in self.columns.items():
+            self.columns[field] = np.concatenate([column, np.full(extra, np.nan)])
+
+        for bitmaps in self.bitmaps.values():
+            for value, bitmap in bitmaps.items():
+                bitmaps[value] = np.concatenate([bitmap, np.zeros(extra, dtype=bool)])
+
+    def _clear_bitmaps(self, row):
+        for field, values in self.row_values[row].items():
+            for value in values:
+                self.bitmaps[field][value][row] = False
+
+    def upsert(self, product):
+        product_id = str(product["_id"])
+        row = self.rows.get(product_id)
+
+        if row is None:
+            if self.size == len(self.alive):
+                self._grow()
+
+            row = self.size
+            self.size += 1
+            self.rows[product_id] = row
+            self.ids[row] = product_id
+            self.row_values.append({})
+            self.names.append("")
+            self.documents.append(None)
+        else:
+            self._clear_bitmaps(row)
+
+        self.alive[row] = True
+        for field in NUMBER_FIELDS:
+            self.columns[field][row] = _number(product.get(field))
+
+        row_values = {}
+        for field in BITMAP_FIELDS:
+            row_values[field] = _values(product.get(field))
+            for value in row_values[field]:
+                bitmap = self.bitmaps[field].get(value)
+                if bitmap is None:
+                    bitmap = self.bitmaps[field][value] = np.zeros(len(self.alive), dtype=bool)
+                bitmap[row] = True
+
+        self.row_values[row] = row_values
+        self.names[row] = product.get("name") or ""
+        self.documents[row] = {field: product[field] for field in LISTING_FIELDS if field in product}
+
+    def remove(self, product_id):
+        row = self.rows.pop(str(product_id), None)
+        if row is None:
+            return
+
+        self.alive[row] = False
+        self._clear_bitmaps(row)
+        self.row_values[row] = {}
+        self.documents[row] = None
+
+    # Rows whose field has a value matching the pattern (same as a case-insensitive $regex)
+    def _pattern_mask(self, field, pattern):
+        mask = np.zeros(self.size, dtype=bool)
+
+        for value, bitmap in self.bitmaps[field].items():
+            if pattern.search(value):
+                mask |= bitmap[:self.size]
+
+        return mask
+
+    # Filter, sort and page the catalog; returns (documents, total_count)
+    def search(self, filters, sort_field, page, limit):
+        mask = self.alive[:self.size].copy()
+
+        for field in ("rim", "size", "weight", "material"):
+            if filters.get(field):
+                mask &= self._pattern_mask(field, re.compile(filters[field], re.IGNORECASE))
+
+        if filters.get("features"):
+            features = np.zeros(self.size, dtype=bool)
+            for value in filters["features"]:
+                if value in self.bitmaps["features"]:
+                    features |= self.bitmaps["features"][value][:self.size]
+            mask &= features
+
+        if filters.get("rating") is not None:
+            mask &= self.columns["rating"][:self.size] == filters["rating"]
+
+        if filters.get("query"):
+            pattern = re.compile(filters["query"], re.IGNORECASE)
+            matches = self._pattern_mask("shape", pattern)
+
+            # Names are unique per product, so they are matched row by row on the remaining candidates
+            for row in np.flatnonzero(mask & ~matches):
+                if pattern.search(self.names[row]):
+                    matches[row] = True
+            mask &= matches
+
+        rows = np.flatnonzero(mask)
+        total_count = int(rows.size)
+        start = (page - 1) * limit
+        end = min(start + limit, total_count)
+
+        if start >= total_count:
+            return [], total_count
+
+        if sort_field:
+            field, direction = sort_field
+            keys = self.columns[field][rows]
+            # Missing values sort first ascending and last descending, like Mongo
+            keys = np.where(np.isnan(keys), -np.inf, keys)
+            if direction < 0:
+                keys = -keys
+
+            # Only the rows up to the end of the page need to be fully ordered: every row whose key
+            # is at most the end-th smallest, ties at the boundary included so _id decides between them
+            if end < total_count:
+                boundary = np.partition(keys, end - 1)[end - 1]
+                candidates = keys <= boundary
+                rows, keys = rows[candidates], keys[candidates]
+
+            rows = rows[np.lexsort((self.ids[rows], keys))]
+
+        return [self.documents[row] for row in rows[start:end]], total_count
+
+_snapshot = None
+_lock = threading.Lock()
+_start_lock = threading.Lock()
+_started = False
+_reload_requested = False
+_synced_at = None
+_last_updated_at = None
+# product_id -> version of the products polled with updated_at == _last_updated_at, the next poll
+# reads that timestamp again (writes in the same millisecond) and skips the ones it already applied
+_last_versions = {}
+# Change stream position to resume from, taken before each full reload so no write is missed
+_resume_token = None
+# Catalog version the snapshot reflects, searches for requests tagged with a newer one go to Mongo
+_version = 0
+# Wakes the sync thread early when a request found the snapshot behind
+_wakeup = threading.Event()
+
+def enabled():
+    return CATALOG_ENGINE == "memory"
+
+# Pipeline of the change stream: product writes, and the catalog version bumps which come after the
+# product writes they cover
+def _stream_pipeline():
+    return [{"$match": {"ns.coll": {"$in": [products.name, http_cache.metadata.name]}}}]
+
+# Current change stream position, None without a replica set
+def _stream_position():
+    try:
+        with db.watch(_stream_pipeline(), max_await_time_ms=1) as stream:
+            stream.try_next()
+            return stream.resume_token
+    except errors.OperationFailure:
+        return None
+
+def _load():
+    global _snapshot, _synced_at, _last_updated_at, _last_versions, _reload_requested, _version, _resume_token
+
+    started = time.time()
+    # Taken before the products, so following the stream from there misses nothing
+    resume_token = _stream_position() if CATALOG_REFRESH_MODE == "changestream" else None
+    # Read before the products, so the snapshot holds at least every write of this version
+    version = http_cache.read_catalog_version()[0]
+    snapshot = CatalogSnapshot()
+    last_updated_at = None
+
+    for product in products.find({}, projection, batch_size=5000):
+        snapshot.upsert(product)
+        updated_at = product.get("updated_at")
+        if updated_at and (last_updated_at is None or updated_at > last_updated_at):
+            last_updated_at = updated_at
+
+    with _lock:
+        _snapshot = snapshot
+        _last_updated_at = last_updated_at
+        _last_versions = {}
+        _resume_token = resume_token
+        _synced_at = started
+        _reload_requested = False
+        _version = version
+
+# Apply products written since the last poll
+def _poll():
+    global _synced_at, _last_updated_at, _last_versions, _version
+
+    started = time.time()
+    version = http_cache.read_catalog_version()[0]
+    # $gte: another write can land in the millisecond of the last one seen
+    query = {"updated_at": {"$gte": _last_updated_at}} if _last_updated_at else {"updated_at": {"$exists": True}}
+    changed = list(products.find(query, projection))
+
+    with _lock:
+        for product in changed:
+            product_id = str(product["_id"])
+            if product["updated_at"] == _last_updated_at and _last_versions.get(product_id) == product.get("version"):
+                continue
+
+            _snapshot.upsert(product)
+
+            if _last_updated_at is None or product["updated_at"] > _last_updated_at:
+                _last_updated_at = product["updated_at"]
+                _last_versions = {}
+            if product["updated_at"] == _last_updated_at:
+                _last_versions[product_id] = product.get("version")
+        _synced_at = started
+        _version = max(_version, version)
+
+# Follow the change stream until a full reload is due
+def _follow_change_stream(until):
+    global _synced_at, _version, _resume_token
+
+    with db.watch(_stream_pipeline(), full_document="updateLookup", max_await_time_ms=1000, resume_after=_resume_token) as stream:
+        while not _reload_requested and time.time() < until:
+            change = stream.try_next()
+
+            if change is None:
+                # Caught up with the oplog
+                _resume_token = stream.resume_token
+                _synced_at = time.time()
+                continue
+
+            with _lock:
+                if change["ns"]["coll"] != products.name:
+                    version = _bumped_version(change)
+                    if version is not None:
+                        _version = max(_version, version)
+                elif change["operationType"] == "delete":
+                    _snapshot.remove(change["documentKey"]["_id"])
+                elif change.get("fullDocument"):
+                    # Full documents aren't projected, shape them like the listing projection does
+                    product = change["fullDocument"]
+                    product["review_count"] = len(product.get("reviews") or [])
+                    product["images"] = (product.get("images") or [])[:1]
+                    _snapshot.upsert(product)
+
+            # Applied, a reconnect resumes after it
+            _resume_token = stream.resume_token
+
+# Catalog version set by a metadata change event (the looked-up full document may already be newer)
+def _bumped_version(change):
+    if change["documentKey"]["_id"] != "catalog":
+        return None
+    if change["operationType"] in ("insert", "replace"):
+        return change["fullDocument"].get("version")
+    if change["operationType"] == "update":
+        return change["updateDescription"]["updatedFields"].get("version")
+    return None
+
+def _sync_loop():
+    mode = CATALOG_REFRESH_MODE
+    reloaded_at = time.time()
+
+    while True:
+        try:
+            if _reload_requested or time.time() - reloaded_at > CATALOG_FULL_RELOAD_SECONDS:
+                _load()
+                reloaded_at = time.time()
+
+            if mode == "changestream":
+                _follow_change_stream(reloaded_at + CATALOG_FULL_RELOAD_SECONDS)
+            else:
+                _poll()
+                _wakeup.wait(CATALOG_POLL_SECONDS)
+                _wakeup.clear()
+        except errors.OperationFailure as e:
+            # Change streams need a replica set
+            if mode == "changestream":
+                print(f"Catalog change stream unavailable, polling instead: {e}")
+                mode = "poll"
+            else:
+                print(f"Error syncing catalog snapshot: {e}")
+                time.sleep(CATALOG_POLL_SECONDS)
+        except errors.PyMongoError as e:
+            print(f"Error syncing catalog snapshot: {e}")
+            time.sleep(CATALOG_POLL_SECONDS)
+
+# Load the snapshot and start following Mongo (once per process, on first use)
+def _ensure_started():
+    global _started
+
+    if _started:
+        return
+
+    with _start_lock:
+        if _started:
+            return
+
+        _load()
+        threading.Thread(target=_sync_loop, name="catalog-snapshot", daemon=True).start()
+        _started = True
+
+# Search the snapshot, returns (documents, total_count) or None when the memory engine is off
+# or the query can't be answered from memory; documents only keep the listing projection's fields
+def search(filters, sort_field, page, limit, projection):
+    if not enabled():
+        return None
+
+    _ensure_started()
+
+    if _version < http_cache.catalog_version()[0]:
+        _wakeup.set()
+        return None
+
+    try:
+        with _lock:
+            documents, total_count = _snapshot.search(filters, sort_field, page, limit)
+    except re.error:
+        # Python and Mongo regex syntax differ, let Mongo answer
+        return None
+
+    return [{name: value for name, value in document.items() if name in projection} for document in documents], total_count
+
+# Apply local writes right away (other workers' writes arrive through the sync thread)
+def apply_changes(product_ids, documents):
+    if not _started:
+        return
+
+    found = {str(product["_id"]) for product in documents}
+
+    with _lock:
+        for product_id in product_ids:
+            if str(product_id) not in found:
+                _snapshot.remove(product_id)
+        for product in documents:
+            _snapshot.upsert(product)
+
+# This worker applied its own write and bumped the catalog to version; the snapshot reflects it if it
+# was current before
+def catalog_bumped(version):
+    global _version
+
+    with _lock:
+        if _version == version - 1:
+            _version = version
+
+def invalidate():
+    global _reload_requested
+
+    _reload_requested = True
+
+def _lag_seconds():
+    return time.time() - _synced_at if _synced_at else float("nan")
+
+def _product_count():
+    return len(_snapshot.rows) if _snapshot else 0
+
+metrics.register_gauge("catalog_snapshot_lag_seconds", "Seconds since the in-memory catalog was last known to match Mongo.", _lag_seconds)
+metrics.register_gauge("catalog_snapshot_products", "Products in the in-memory catalog.", _product_count)
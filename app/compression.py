@@ -0,0 +1,61 @@
+from flask import request
+from dotenv import load_dotenv
+import os
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses fall back to gzip without it
+    brotli = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Only responses at least this big (bytes) are compressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+COMPRESS_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+
+def _encoding():
+    accepted = request.accept_encodings
+
+    if brotli is not None and accepted["br"] and accepted["br"] >= accepted["gzip"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+# Compress large buffered responses with brotli or gzip, depending on what the client accepts
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESS_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = _encoding()
+    if encoding is None:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
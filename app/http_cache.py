@@ -0,0 +1,141 @@
+from flask import g, request, make_response, current_app, has_request_context
+from pymongo import MongoClient, ReturnDocument
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from functools import wraps
+from dotenv import load_dotenv
+import os
+import time
+import hashlib
+import datetime
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+metadata = db["metadata"]
+
+# How long browsers/CDNs may reuse a catalog response before revalidating
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", 60))
+# How long a worker reuses the catalog version it last read (0 reads it on every request)
+CATALOG_VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", 1))
+
+# ((version, updated_at), monotonic time it was read) of the catalog, per worker process
+_catalog = None
+
+# Update operators that mark a product as changed, merge into the product's update
+def product_changed():
+    return {
+        "$set": {"updated_at": datetime.datetime.now(datetime.timezone.utc)},
+        "$inc": {"version": 1}
+    }
+
+# Merge product_changed() into an existing update document
+def with_product_changed(update):
+    changed = product_changed()
+
+    for operator, fields in changed.items():
+        update[operator] = {**update.get(operator, {}), **fields}
+
+    return update
+
+# Any product write changes the listings, bump the catalog-wide version; returns (version, updated_at)
+def bump_catalog_version():
+    catalog = metadata.find_one_and_update(
+        {"_id": "catalog"},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return catalog["version"], catalog["updated_at"]
+
+# Keep a catalog version this worker wrote or read, unless a newer one is already known
+def remember_catalog_version(catalog):
+    global _catalog
+
+    if _catalog is None or catalog[0] >= _catalog[0][0]:
+        _catalog = (catalog, time.monotonic())
+
+# Read the current catalog (version, updated_at) from Mongo
+def read_catalog_version():
+    catalog = metadata.find_one({"_id": "catalog"}) or {}
+    result = (catalog.get("version", 0), catalog.get("updated_at"))
+    remember_catalog_version(result)
+    return result
+
+# Catalog (version, updated_at) as of at most CATALOG_VERSION_TTL seconds ago, fixed for the rest of a
+# request so its ETag and the in-memory indexes answering it agree on the version
+def catalog_version():
+    if has_request_context() and "catalog" in g:
+        return g.catalog
+
+    catalog = _catalog
+    if catalog is None or time.monotonic() - catalog[1] > CATALOG_VERSION_TTL:
+        result = read_catalog_version()
+    else:
+        result = catalog[0]
+
+    if has_request_context():
+        g.catalog = result
+    return result
+
+# Validators for a single product: (etag, last_modified), or None if it doesn't exist
+def product_validators(id):
+    try:
+        product = products.find_one({"_id": ObjectId(id)}, {"version": 1, "updated_at": 1})
+    except InvalidId:
+        return None
+
+    if not product:
+        return None
+
+    # Sparse fieldsets (?fields=) change the body, so the query string is part of the tag
+    query = hashlib.sha1(request.query_string).hexdigest()[:16]
+    return f"product-{product['_id']}-{product.get('version', 0)}-{query}", product.get("updated_at")
+
+# Validators for catalog listings, the query string is part of the tag
+def catalog_validators(*args, **kwargs):
+    version, updated_at = catalog_version()
+    query = hashlib.sha1(request.query_string).hexdigest()[:16]
+
+    return f"catalog-{version}-{request.path}-{query}", updated_at
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if last_modified and request.if_modified_since:
+        # HTTP dates have a one-second resolution
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+
+    return False
+
+# Answer conditional GETs with 304 before running the handler, and add ETag/Last-Modified/Cache-Control
+def conditional(validators):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorated_function(*args, **kwargs):
+            result = validators(*args, **kwargs)
+            if result is None:
+                return fn(*args, **kwargs)
+
+            etag, last_modified = result
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = CATALOG_MAX_AGE
+            return response
+        return decorated_function
+    return wrapper
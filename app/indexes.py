@@ -0,0 +1,64 @@
+from pymongo import MongoClient, ASCENDING, DESCENDING, errors
+from dotenv import load_dotenv
+from .jobs import JOB_RETENTION_SECONDS
+from .analytics import SALES_RECORDED_TTL
+import os
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+
+# Create the transactions collection as a time-series collection (Mongo 5.0+) keyed by user_id.
+# Only applies when the collection doesn't exist yet, see `python -m app.migrations transaction-dates`
+TRANSACTIONS_TIMESERIES = os.getenv("TRANSACTIONS_TIMESERIES", "false").lower() == "true"
+TRANSACTIONS_TIMESERIES_OPTIONS = {"timeField": "date", "metaField": "user_id", "granularity": "hours"}
+
+# Indexes the queries rely on, as (collection, keys, options)
+INDEXES = [
+    # Products changed since a timestamp (leaderboard and in-memory catalog polling)
+    ("products", [("updated_at", DESCENDING)], {}),
+    # Per-user transaction history, newest first
+    ("transactions", [("user_id", ASCENDING), ("date", DESCENDING)], {}),
+    # Admin date range queries
+    ("transactions", [("date", DESCENDING)], {}),
+    # One cart item per (user, product, color) and one wishlist item per (user, product)
+    ("carts", [("user_id", ASCENDING), ("product_id", ASCENDING), ("color", ASCENDING)], {"unique": True}),
+    ("wishlists", [("user_id", ASCENDING), ("product_id", ASCENDING)], {"unique": True}),
+    # Sales rollups
+    ("sales_products", [("units", DESCENDING)], {}),
+    ("sales_products", [("revenue", DESCENDING)], {}),
+    ("sales_attributes", [("_id.dimension", ASCENDING), ("units", DESCENDING)], {}),
+    ("sales_recorded", [("recorded_at", ASCENDING)], {"expireAfterSeconds": SALES_RECORDED_TTL}),
+    # Job queue claims, and expiry of finished jobs
+    ("jobs", [("state", ASCENDING), ("visible_at", ASCENDING)], {}),
+    ("jobs", [("finished_at", ASCENDING)], {"expireAfterSeconds": JOB_RETENTION_SECONDS}),
+]
+
+# Time-series collections have no _id index, GET /transaction/<id> and the migrations' _id lookups need one
+if TRANSACTIONS_TIMESERIES:
+    INDEXES.append(("transactions", [("_id", ASCENDING)], {}))
+
+def is_timeseries(name):
+    collection = next(db.list_collections(filter={"name": name}), None)
+    return bool(collection) and collection.get("type") == "timeseries"
+
+# Create collections that need options before their first insert
+def ensure_collections():
+    if TRANSACTIONS_TIMESERIES and not db.list_collection_names(filter={"name": "transactions"}):
+        try:
+            db.create_collection("transactions", timeseries=TRANSACTIONS_TIMESERIES_OPTIONS)
+        except errors.PyMongoError as e:
+            print(f"Error creating time-series collection transactions: {e}")
+
+# Create missing collections and indexes (no-op for existing ones)
+def ensure_indexes():
+    ensure_collections()
+
+    for collection, keys, options in INDEXES:
+        try:
+            db[collection].create_index(keys, **options)
+        except errors.PyMongoError as e:
+            print(f"Error creating index {keys} on {collection}: {e}")
@@ -0,0 +1,192 @@
+from pymongo import MongoClient, ReturnDocument
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from . import metrics
+import os
+import time
+import argparse
+import datetime
+import importlib
+import threading
+import traceback
+import multiprocessing
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+jobs = db["jobs"]
+
+# "queue" runs follow-up work in background workers, "inline" runs it in the request like before
+JOBS_MODE = os.getenv("JOBS_MODE", "queue").lower()
+# Worker threads started in every app process; 0 leaves the queue to `python -m app.jobs worker`
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 1))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+# A claimed job not finished within this many seconds (worker died) is picked up again
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+# First retry delay in seconds, doubled on every further attempt
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 10))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1))
+# Finished jobs are deleted after this many seconds (TTL index), failed ones are kept
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 86400))
+
+# Job type -> "module:function" in this package, imported when first run so worker
+# processes only load what they execute; the job payload is passed as keyword arguments
+HANDLERS = {
+    "recompute_rating": "review:recompute_rating",
+    "record_sales": "analytics:record_sales",
+    "recompute_rollups": "analytics:recompute_rollups",
+    "refresh_similar": "similar:refresh",
+    "build_similar": "similar:build"
+}
+
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers_pid = None
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _handler(job_type):
+    module_name, function_name = HANDLERS[job_type].split(":")
+    return getattr(importlib.import_module(f".{module_name}", __package__), function_name)
+
+# Queue a job, returns its id (None when JOBS_MODE=inline ran it right away)
+def enqueue(job_type, **payload):
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type {job_type}")
+
+    if JOBS_MODE == "inline":
+        _handler(job_type)(**payload)
+        return None
+
+    now = _now()
+    job_id = jobs.insert_one({
+        "type": job_type,
+        "payload": payload,
+        "state": "queued",
+        "attempts": 0,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "visible_at": now,
+        "created_at": now
+    }).inserted_id
+
+    ensure_workers()
+    _wakeup.set()
+    return job_id
+
+# Take the next due job; it stays invisible to other workers for JOB_VISIBILITY_TIMEOUT. Every claim
+# counts as an attempt, also one whose worker dies. The claim token changes on every claim, so a worker
+# whose job was claimed again can't overwrite its state
+def claim():
+    now = _now()
+
+    return jobs.find_one_and_update(
+        {"state": {"$in": ["queued", "running"]}, "visible_at": {"$lte": now}},
+        {
+            "$set": {
+                "state": "running",
+                "visible_at": now + datetime.timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+                "started_at": now,
+                "claim": ObjectId()
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("visible_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+# Update the job if this worker still holds its claim
+def _finish(job, update):
+    result = jobs.update_one({"_id": job["_id"], "claim": job["claim"]}, {"$set": update})
+    if not result.matched_count:
+        print(f"Job {job['_id']} ({job['type']}) was claimed again by another worker, leaving its state")
+
+def run_job(job):
+    max_attempts = job.get("max_attempts", JOB_MAX_ATTEMPTS)
+
+    # Claimed again after its last attempt's worker died or ran past the visibility timeout (e.g. a job
+    # that kills its worker): fail it instead of running it forever
+    if job["attempts"] > max_attempts:
+        print(f"Job {job['_id']} ({job['type']}) failed after {max_attempts} attempts: worker died or timed out")
+        _finish(job, {"state": "failed", "failed_at": _now(), "last_error": "Worker died or timed out"})
+        return
+
+    try:
+        _handler(job["type"])(**job.get("payload", {}))
+    except Exception as e:
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()
+
+        if job["attempts"] >= max_attempts:
+            print(f"Job {job['_id']} ({job['type']}) failed after {job['attempts']} attempts: {error}")
+            _finish(job, {"state": "failed", "failed_at": _now(), "last_error": error})
+        else:
+            retry_at = _now() + datetime.timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1))
+            _finish(job, {"state": "queued", "visible_at": retry_at, "last_error": error})
+        return
+
+    _finish(job, {"state": "done", "finished_at": _now()})
+
+# Worker loop: run due jobs, wait for new ones (or the next poll) when the queue is empty
+def work():
+    while True:
+        try:
+            job = claim()
+        except Exception as e:
+            print(f"Error claiming job: {e}")
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+
+        if job:
+            try:
+                run_job(job)
+            except Exception:
+                # Bookkeeping failed, the job becomes visible again after its timeout
+                print(f"Error running job {job['_id']} ({job['type']}):\n{traceback.format_exc()}")
+                time.sleep(JOB_POLL_SECONDS)
+        else:
+            _wakeup.wait(JOB_POLL_SECONDS)
+            _wakeup.clear()
+
+# Start this process's worker threads (once per process, forked app workers start their own)
+def ensure_workers():
+    global _workers_pid
+
+    if JOBS_MODE != "queue" or _workers_pid == os.getpid():
+        return
+
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+
+        for number in range(JOB_WORKER_THREADS):
+            threading.Thread(target=work, name=f"job-worker-{number}", daemon=True).start()
+        _workers_pid = os.getpid()
+
+def init_app(app):
+    app.before_request(ensure_workers)
+
+def _count(state):
+    return jobs.count_documents({"state": state})
+
+metrics.register_gauge("jobs_queued", "Background jobs waiting to run.", lambda: _count("queued"))
+metrics.register_gauge("jobs_running", "Background jobs claimed by a worker.", lambda: _count("running"))
+metrics.register_gauge("jobs_failed", "Background jobs that ran out of attempts.", lambda: _count("failed"))
+
+# Dedicated worker processes, e.g.: python -m app.jobs worker --processes 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    args = parser.parse_args()
+
+    # Spawned processes open their own Mongo connections
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=work, name=f"job-worker-{number}") for number in range(args.processes)]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,47 @@
+from flask.json.provider import DefaultJSONProvider
+from bson.objectid import ObjectId
+import datetime
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+ORJSON_OPTIONS = (
+    orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if orjson else 0
+)
+
+# JSON provider that encodes Mongo documents as they come from pymongo (ObjectId, datetime)
+# so handlers don't have to rebuild every document before returning it. Datetimes are ISO 8601
+# with their offset, naive ones (as pymongo returns them) are UTC.
+class MongoJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+
+        if isinstance(o, datetime.datetime):
+            return (o if o.tzinfo else o.replace(tzinfo=datetime.timezone.utc)).isoformat()
+
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,214 @@
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from bisect import insort, bisect_left
+from dotenv import load_dotenv
+from . import http_cache
+import os
+import time
+import datetime
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+
+# Number of products kept per leaderboard and full refresh interval (other workers' updates are
+# polled as soon as the catalog version moves, the full refresh also catches their deletes)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 2000))
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", 60))
+
+# Leaderboards kept in memory, by descending value of the field
+BOARDS = ("sold", "created_at")
+
+# Fields kept for each product, same as the listing endpoints return
+LISTING_FIELDS = ("_id", "name", "price", "sold", "review_count", "rating", "images", "created_at")
+
+# Listing fields, plus what catching up with other workers' writes reads
+projection = {
+    "_id": 1,
+    "name": 1,
+    "price": 1,
+    "sold": 1,
+    "review_count": {"$size": "$reviews"},
+    "rating": 1,
+    "images": {"$slice": [{"$ifNull": ["$images", []]}, 1]},
+    "created_at": 1,
+    "updated_at": 1,
+    "version": 1
+}
+
+# field -> {"keys": sorted rank keys, "entries": product_id -> (key, document)}
+# Invariant: a board always holds exactly the best len(keys) products of the catalog
+_boards = {field: {"keys": [], "entries": {}} for field in BOARDS}
+_product_count = 0
+_built_at = None
+# Catalog version the boards reflect, requests tagged with a newer one poll the changes first
+_version = 0
+# Products with updated_at >= this are polled on catch-up (>=: writes in the same millisecond), and
+# product_id -> version of the ones already applied with exactly that updated_at, skipped when re-read
+_last_updated_at = None
+_last_versions = {}
+_lock = threading.Lock()
+_catch_up_lock = threading.Lock()
+
+# Sort key for ascending bisect order, best product first and missing values last like Mongo
+def _rank_key(field, product):
+    value = product.get(field)
+
+    if isinstance(value, datetime.datetime):
+        value = value.timestamp()
+    if not isinstance(value, (int, float)):
+        return (1, 0, str(product["_id"]))
+
+    return (0, -value, str(product["_id"]))
+
+def _remove(board, product_id):
+    entry = board["entries"].pop(product_id, None)
+    if not entry:
+        return
+
+    index = bisect_left(board["keys"], entry[0])
+    if index < len(board["keys"]) and board["keys"][index] == entry[0]:
+        board["keys"].pop(index)
+
+def _insert(field, board, product):
+    key = _rank_key(field, product)
+    # Documents re-read for several indexes carry more fields than the listings return
+    board["entries"][key[2]] = (key, {name: product[name] for name in LISTING_FIELDS if name in product})
+    insort(board["keys"], key)
+
+# Latest updated_at in the catalog and the versions of the products written at that moment
+def _latest_updated_at():
+    product = products.find_one({"updated_at": {"$exists": True}}, {"updated_at": 1}, sort=[("updated_at", DESCENDING)])
+    if not product:
+        return None, {}
+
+    latest = products.find({"updated_at": product["updated_at"]}, {"version": 1})
+    return product["updated_at"], {str(product["_id"]): product.get("version") for product in latest}
+
+# Reload the top products of every board and the catalog size from Mongo
+def rebuild():
+    global _boards, _product_count, _built_at, _version, _last_updated_at, _last_versions
+
+    # Read before the products, so the boards hold at least every write of this version and the
+    # next catch-up polls from there
+    version = http_cache.read_catalog_version()[0]
+    last_updated_at, last_versions = _latest_updated_at()
+    boards = {}
+    for field in BOARDS:
+        board = {"keys": [], "entries": {}}
+        # _id breaks ties like the Mongo fallback does
+        for product in products.find({}, projection).sort([(field, DESCENDING), ("_id", ASCENDING)]).limit(LEADERBOARD_SIZE):
+            _insert(field, board, product)
+        boards[field] = board
+
+    product_count = products.count_documents({})
+
+    with _lock:
+        _boards = boards
+        _product_count = product_count
+        _built_at = time.monotonic()
+        _version = version
+        _last_updated_at = last_updated_at
+        _last_versions = last_versions
+
+# Apply the products other workers updated since the last catch-up, so the boards reflect version
+# (read before polling, so every write it covers is in the poll). One request polls, the ones
+# arriving meanwhile wait for it
+def _catch_up(version):
+    global _version, _last_updated_at, _last_versions, _product_count
+
+    with _catch_up_lock:
+        if _version >= version:
+            return
+
+        query = {"updated_at": {"$gte": _last_updated_at}} if _last_updated_at else {"updated_at": {"$exists": True}}
+        changed = [
+            product for product in products.find(query, projection)
+            if product["updated_at"] != _last_updated_at or _last_versions.get(str(product["_id"])) != product.get("version")
+        ]
+        product_count = products.estimated_document_count()
+
+        apply_changes([product["_id"] for product in changed], changed)
+
+        with _lock:
+            _product_count = product_count
+            for product in changed:
+                if _last_updated_at is None or product["updated_at"] > _last_updated_at:
+                    _last_updated_at = product["updated_at"]
+                    _last_versions = {}
+                if product["updated_at"] == _last_updated_at:
+                    _last_versions[str(product["_id"])] = product.get("version")
+            _version = max(_version, version)
+
+# Drop the boards, they are reloaded on next use
+def invalidate():
+    global _built_at
+
+    _built_at = None
+
+# Reposition changed products; documents are re-read with (at least) this module's projection
+def apply_changes(product_ids, documents, created=0, removed=0):
+    global _product_count
+
+    if _built_at is None:
+        return
+
+    with _lock:
+        complete = {field: len(_boards[field]["keys"]) >= _product_count for field in BOARDS}
+        _product_count += created - removed
+
+        for field in BOARDS:
+            board = _boards[field]
+
+            for product_id in product_ids:
+                _remove(board, str(product_id))
+
+            for product in documents:
+                key = _rank_key(field, product)
+
+                # Only products ranking above the last kept one can enter without breaking the
+                # invariant, unless the board already holds the whole catalog
+                if complete[field] or (board["keys"] and key < board["keys"][-1]):
+                    _insert(field, board, product)
+
+            while len(board["keys"]) > LEADERBOARD_SIZE:
+                _remove(board, board["keys"][-1][2])
+
+# This worker applied its own write and bumped the catalog to version; the boards reflect it if they
+# were current before (a write by another worker in between leaves them behind)
+def catalog_bumped(version):
+    global _version
+
+    with _lock:
+        if _version == version - 1:
+            _version = version
+
+# One page of a leaderboard, or None when the page is beyond what is kept in memory. Boards behind the
+# catalog version the request is tagged with (another worker wrote meanwhile) catch up first
+def page(field, page, limit):
+    if _built_at is None or time.monotonic() - _built_at > LEADERBOARD_REFRESH_SECONDS:
+        rebuild()
+    else:
+        version = http_cache.catalog_version()[0]
+        if _version < version:
+            _catch_up(version)
+
+    start = (page - 1) * limit
+
+    with _lock:
+        board = _boards[field]
+        if start + limit > len(board["keys"]) and len(board["keys"]) < _product_count:
+            return None
+
+        documents = [board["entries"][key[2]][1] for key in board["keys"][start:start + limit]]
+        product_count = _product_count
+
+    # Best sellers are listed without created_at, like the Mongo query they replace
+    if field != "created_at":
+        documents = [{name: value for name, value in document.items() if name != "created_at"} for document in documents]
+
+    return documents, product_count
@@ -0,0 +1,177 @@
+from flask import Blueprint, Response, g, request, has_request_context, current_app
+from pymongo import monitoring
+from dotenv import load_dotenv
+import os
+import time
+import threading
+import contextvars
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Requests slower than this are logged with their Mongo op count
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_OPS_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Create a Blueprint for metrics
+metrics_bp = Blueprint('metrics', __name__)
+
+_lock = threading.Lock()
+# (method, route, status) -> [bucket counts..., count, sum]
+_request_latency = {}
+# (method, route) -> [bucket counts..., count, sum]
+_request_mongo_ops = {}
+# (route, command) -> [count, seconds]
+_mongo_commands = {}
+# (route, role) -> count, "leader" requests ran the handler, "follower" ones shared its response
+_single_flight = {}
+_listener_registered = False
+# name -> (help, function returning the current value), for state owned by other modules
+_gauges = {}
+
+# Command totals of the request a coroutine on the async_db loop runs for (the loop has no request context)
+request_commands = contextvars.ContextVar("request_commands", default=None)
+
+# Command totals of the current request, None outside requests
+def current_commands():
+    if has_request_context() and "mongo_commands" in g:
+        return g.mongo_commands
+    return None
+
+# Counts Mongo commands and their time for the request that issued them
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        # Commands issued outside a request (startup, background threads) aren't attributed
+        commands = current_commands()
+        if commands is None:
+            commands = request_commands.get()
+        if commands is None:
+            return
+
+        command = commands.setdefault(event.command_name, [0, 0.0])
+        command[0] += 1
+        command[1] += event.duration_micros / 1_000_000
+
+def _observe(histograms, key, buckets, value):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(buckets) + 2)
+
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            histogram[index] += 1
+    histogram[-2] += 1
+    histogram[-1] += value
+
+def before_request():
+    g.request_started = time.perf_counter()
+    g.mongo_commands = {}
+
+def after_request(response):
+    if "request_started" not in g:
+        return response
+
+    duration = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    mongo_ops = sum(count for count, _ in g.mongo_commands.values())
+    mongo_seconds = sum(seconds for _, seconds in g.mongo_commands.values())
+
+    with _lock:
+        _observe(_request_latency, (request.method, route, str(response.status_code)), LATENCY_BUCKETS, duration)
+        _observe(_request_mongo_ops, (request.method, route), MONGO_OPS_BUCKETS, mongo_ops)
+
+        for command_name, (count, seconds) in g.mongo_commands.items():
+            totals = _mongo_commands.setdefault((route, command_name), [0, 0.0])
+            totals[0] += count
+            totals[1] += seconds
+
+    if duration * 1000 >= SLOW_REQUEST_MS:
+        current_app.logger.warning(
+            "Slow request %s %s (%s) %d in %.1f ms, %d Mongo ops in %.1f ms: %s",
+            request.method, request.path, route, response.status_code, duration * 1000,
+            mongo_ops, mongo_seconds * 1000,
+            ", ".join(f"{name} x{count}" for name, (count, _) in g.mongo_commands.items())
+        )
+
+    return response
+
+# Register the Mongo listener and the request hooks; must run before any MongoClient is created
+def init_app(app):
+    global _listener_registered
+
+    if not _listener_registered:
+        monitoring.register(MongoCommandListener())
+        _listener_registered = True
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+
+# Count a request served through single_flight.coalesce
+def observe_single_flight(route, role):
+    with _lock:
+        _single_flight[(route, role)] = _single_flight.get((route, role), 0) + 1
+
+# Export a value read at scrape time (e.g. the size or staleness of an in-memory index)
+def register_gauge(name, help_text, function):
+    _gauges[name] = (help_text, function)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _histogram_lines(name, histograms, buckets, label_names):
+    lines = []
+
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+
+        for index, bound in enumerate(buckets):
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {histogram[index]}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram[-2]}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram[-1]}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram[-2]}")
+
+    return lines
+
+# Prometheus text format, metrics are per worker process
+@metrics_bp.route("", methods=["GET"])
+def get_metrics():
+    with _lock:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+            *_histogram_lines("http_request_duration_seconds", _request_latency, LATENCY_BUCKETS, ("method", "route", "status")),
+            "# HELP http_request_mongo_operations Mongo commands issued per request.",
+            "# TYPE http_request_mongo_operations histogram",
+            *_histogram_lines("http_request_mongo_operations", _request_mongo_ops, MONGO_OPS_BUCKETS, ("method", "route")),
+            "# HELP mongo_commands_total Mongo commands by route and command.",
+            "# TYPE mongo_commands_total counter",
+            *(f"mongo_commands_total{_labels(route=route, command=command)} {count}"
+              for (route, command), (count, _) in sorted(_mongo_commands.items())),
+            "# HELP mongo_command_seconds_total Time spent in Mongo commands by route and command.",
+            "# TYPE mongo_command_seconds_total counter",
+            *(f"mongo_command_seconds_total{_labels(route=route, command=command)} {seconds}"
+              for (route, command), (_, seconds) in sorted(_mongo_commands.items())),
+            "# HELP single_flight_requests_total Coalesced reads by route, leaders ran the handler and followers shared its response.",
+            "# TYPE single_flight_requests_total counter",
+            *(f"single_flight_requests_total{_labels(route=route, role=role)} {count}"
+              for (route, role), count in sorted(_single_flight.items()))
+        ]
+
+    for name, (help_text, function) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {function()}"]
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,152 @@
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+from .indexes import ensure_indexes, ensure_collections, is_timeseries, TRANSACTIONS_TIMESERIES
+import os
+import argparse
+import datetime
+import zoneinfo
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+users = db["users"]
+carts = db["carts"]
+wishlists = db["wishlists"]
+transactions = db["transactions"]
+
+# Users migrated per batch
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 1000))
+
+# Move the cart and wishlist arrays embedded in users to the carts/wishlists collections.
+# Safe to re-run: items are upserted with their quantity set (not added) and the arrays are only
+# removed once copied.
+def split_carts():
+    ensure_indexes()
+    migrated = 0
+    query = {"$or": [{"cart": {"$exists": True}}, {"wishlist": {"$exists": True}}]}
+
+    while True:
+        batch = list(users.find(query, {"cart": 1, "wishlist": 1}).limit(MIGRATION_BATCH_SIZE))
+        if not batch:
+            break
+
+        migrated_at = datetime.datetime.now(datetime.timezone.utc)
+        cart_operations = []
+        wishlist_operations = []
+
+        for user in batch:
+            # Keep the array order through added_at
+            for position, item in enumerate(user.get("cart") or []):
+                cart_operations.append(UpdateOne(
+                    {"user_id": user["_id"], "product_id": item["product_id"], "color": item.get("color")},
+                    {"$set": {"quantity": item.get("quantity", 1)},
+                     "$setOnInsert": {"added_at": migrated_at + datetime.timedelta(microseconds=position)}},
+                    upsert=True
+                ))
+
+            for position, item in enumerate(user.get("wishlist") or []):
+                wishlist_operations.append(UpdateOne(
+                    {"user_id": user["_id"], "product_id": item["product_id"]},
+                    {"$setOnInsert": {"added_at": migrated_at + datetime.timedelta(microseconds=position)}},
+                    upsert=True
+                ))
+
+        if cart_operations:
+            carts.bulk_write(cart_operations, ordered=False)
+        if wishlist_operations:
+            wishlists.bulk_write(wishlist_operations, ordered=False)
+
+        users.update_many({"_id": {"$in": [user["_id"] for user in batch]}}, {"$unset": {"cart": "", "wishlist": ""}})
+        migrated += len(batch)
+        print(f"{migrated} users migrated", end="\r")
+
+    print(f"{migrated} users migrated")
+
+# Parse a stored ISO date string; strings without an offset were written with the server's local
+# datetime.now() and are read in source_timezone (None: this machine's local timezone)
+def _parse_date(value, source_timezone=None):
+    date = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if date.tzinfo:
+        return date
+    return date.replace(tzinfo=source_timezone) if source_timezone else date.astimezone()
+
+# Convert transaction dates stored as ISO strings to BSON dates, and with TRANSACTIONS_TIMESERIES=true
+# move a regular transactions collection into a time-series one (the old one is kept as
+# transactions_legacy until dropped by hand). Run it with the app stopped; safe to re-run.
+# timezone is the IANA name of the timezone the app server wrote the strings in (default: local).
+def transaction_dates(timezone=None):
+    source_timezone = zoneinfo.ZoneInfo(timezone) if timezone else None
+    converted = 0
+
+    while True:
+        batch = list(transactions.find({"date": {"$type": "string"}}, {"date": 1}).limit(MIGRATION_BATCH_SIZE))
+        if not batch:
+            break
+
+        operations = []
+        for transaction in batch:
+            try:
+                operations.append(UpdateOne({"_id": transaction["_id"]}, {"$set": {"date": _parse_date(transaction["date"], source_timezone)}}))
+            except ValueError:
+                print(f"Skipping transaction {transaction['_id']} with unparseable date {transaction['date']!r}")
+                # Park it so the loop doesn't pick it up again
+                operations.append(UpdateOne({"_id": transaction["_id"]}, {"$rename": {"date": "invalid_date"}}))
+
+        transactions.bulk_write(operations, ordered=False)
+        converted += len(batch)
+        print(f"{converted} transaction dates converted", end="\r")
+
+    print(f"{converted} transaction dates converted")
+
+    if not TRANSACTIONS_TIMESERIES:
+        return
+
+    if not is_timeseries("transactions"):
+        transactions.rename("transactions_legacy")
+        ensure_collections()
+    elif not db.list_collection_names(filter={"name": "transactions_legacy"}):
+        return
+
+    # Copy in _id order, resuming after the last copied transaction if interrupted
+    legacy = db["transactions_legacy"]
+    last = transactions.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    # Time-series documents need a date, parked unparseable ones stay in the legacy collection
+    query = {"_id": {"$gt": last["_id"]}, "date": {"$type": "date"}} if last else {"date": {"$type": "date"}}
+    copied = 0
+    batch = []
+
+    for transaction in legacy.find(query).sort("_id", 1):
+        batch.append(transaction)
+
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            transactions.insert_many(batch)
+            copied += len(batch)
+            batch = []
+            print(f"{copied} transactions copied to the time-series collection", end="\r")
+
+    if batch:
+        transactions.insert_many(batch)
+        copied += len(batch)
+
+    ensure_indexes()
+    print(f"{copied} transactions copied to the time-series collection, drop transactions_legacy once verified")
+
+# name -> migration, run with: python -m app.migrations <name>
+MIGRATIONS = {
+    "split-carts": split_carts,
+    "transaction-dates": transaction_dates
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument("migration", choices=list(MIGRATIONS))
+    parser.add_argument("--timezone", help="transaction-dates: timezone of dates stored without an offset, e.g. Asia/Jakarta (default: local)")
+    args = parser.parse_args()
+
+    if args.timezone and args.migration != "transaction-dates":
+        parser.error("--timezone only applies to transaction-dates")
+
+    MIGRATIONS[args.migration](**({"timezone": args.timezone} if args.timezone else {}))
@@ -1,5 +1,9 @@
 from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from . import prediction_cache, recommendation
 from pymongo import MongoClient
+from bson.objectid import ObjectId
+from functools import wraps
 from dotenv import load_dotenv
 from PIL import Image
 import numpy as np
@@ -9,6 +13,9 @@ import cv2
 import time
 import shutil
 import joblib
+import tempfile
+import threading
+import contextlib
 
 # Load environment variables from .env file
 load_dotenv()
@@ -25,26 +32,132 @@ products = db["products"]
 # Create a Blueprint for model
 model_bp = Blueprint('model', __name__)
 
-predictor_path = 'shape_predictor_68_face_landmarks.dat'
-scaler_path = 'models/scaler.pkl'
-model_path = 'models/model.pkl'
+# Role check decorator
+def role_required(role):
+    def wrapper(fn):
+        @wraps(fn)
+        @jwt_required()
+        def decorated_function(*args, **kwargs):
+            current_user = get_jwt_identity()
+            user = users.find_one({"_id": ObjectId(current_user)}, {"role": 1})
+            
+            if not user:
+                return jsonify({"error": "User not found"}), 404
 
-scaler = joblib.load(scaler_path)
-model = joblib.load(model_path)
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor("models/shape_predictor_68_face_landmarks.dat")
+            if user.get("role") != role:
+                return jsonify({"error": "Access forbidden: Insufficient permissions"}), 403
 
-def detect_facial_landmarks(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = detector(gray)
+            return fn(*args, **kwargs)
+        return decorated_function
+    return wrapper
+
+# Landmark index positions read by extract_features_from_landmarks
+FEATURE_LANDMARKS = list(range(1, 20)) + [27, 33] + list(range(36, 49)) + [51, 54, 57]
+
+# Full 68-point dlib predictor
+class Dlib68Landmarks:
+    default_path = "models/shape_predictor_68_face_landmarks.dat"
+
+    def __init__(self, path):
+        self.predictor = dlib.shape_predictor(path)
+
+    def __call__(self, gray, face):
+        landmarks = self.predictor(gray, face)
+        landmark_points = [(landmarks.part(n).x, landmarks.part(n).y) for n in range(68)]
+        return np.array(landmark_points)
+
+# Smaller dlib predictor trained only on FEATURE_LANDMARKS (in that order, see
+# tools/train_compact_landmarks.py); points are put back at their 68-point positions
+class CompactLandmarks:
+    default_path = "models/shape_predictor_compact_landmarks.dat"
+
+    def __init__(self, path):
+        self.predictor = dlib.shape_predictor(path)
+
+    def __call__(self, gray, face):
+        landmarks = self.predictor(gray, face)
+        landmark_points = np.zeros((68, 2), dtype=int)  # Points the features don't use stay at 0
+
+        for n, index in enumerate(FEATURE_LANDMARKS):
+            landmark_points[index] = (landmarks.part(n).x, landmarks.part(n).y)
+
+        return landmark_points
+
+LANDMARK_BACKENDS = {
+    "dlib68": Dlib68Landmarks,
+    "compact": CompactLandmarks
+}
+
+landmark_backend = os.getenv("LANDMARK_BACKEND", "dlib68")
+if landmark_backend not in LANDMARK_BACKENDS:
+    raise EnvironmentError(f"LANDMARK_BACKEND must be one of: {', '.join(LANDMARK_BACKENDS)}")
+
+predictor_path = os.getenv("PREDICTOR_PATH") or LANDMARK_BACKENDS[landmark_backend].default_path
+scaler_path = os.getenv("SCALER_PATH", "models/scaler.pkl")
+model_path = os.getenv("MODEL_PATH", "models/model.pkl")
+
+# Model artifacts are loaded on first use (or preloaded by create_app) instead of at import time
+scaler = None
+model = None
+detector = None
+predictor = None
+model_version = None
+_model_lock = threading.Lock()
+
+# Load scaler, classifier, face detector and landmark backend once per process
+def load_model():
+    global scaler, model, detector, predictor, model_version
+
+    if predictor is not None:
+        return
+
+    with _model_lock:
+        # Another thread may have finished loading while we waited for the lock
+        if predictor is not None:
+            return
+
+        loaded_scaler = joblib.load(scaler_path)
+        loaded_model = joblib.load(model_path)
+        loaded_detector = dlib.get_frontal_face_detector()
+        loaded_predictor = LANDMARK_BACKENDS[landmark_backend](predictor_path)
+
+        # Version used to key cached predictions; defaults to the backend and the artifacts' size and mtime
+        model_version = os.getenv("MODEL_VERSION") or landmark_backend + "-" + "-".join(
+            f"{os.path.getsize(path)}:{int(os.path.getmtime(path))}"
+            for path in (scaler_path, model_path, predictor_path)
+        )
+
+        scaler = loaded_scaler
+        model = loaded_model
+        detector = loaded_detector
+        # predictor is assigned last because it is the "loaded" flag checked above
+        predictor = loaded_predictor
+
+# Record how long the block took in timings[stage]; timings is None (nothing recorded) outside
+# benchmarks/predict_benchmark.py
+@contextlib.contextmanager
+def timed(timings, stage):
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+
+def detect_facial_landmarks(img, timings=None):
+    with timed(timings, "grayscale"):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    with timed(timings, "detect"):
+        faces = detector(gray)
 
     if len(faces) == 0:
         return None
 
     face = faces[0]
-    landmarks = predictor(gray, face)
-    landmark_points = [(landmarks.part(n).x, landmarks.part(n).y) for n in range(68)]
-    return np.array(landmark_points)
+    with timed(timings, "landmark"):
+        return predictor(gray, face)
 
 def extract_features_from_landmarks(landmarks):
     features = []
@@ -106,72 +219,145 @@ def extract_features_from_landmarks(landmarks):
 
     return features
 
-@model_bp.route("/predict", methods=["POST"])
-def predict():
-    # Check if the image file is provided in the request
-    if 'picture' not in request.files:
-        return jsonify({"message": "Tidak ada gambar yang diupload"}), 400
-
-    # Extract the image file and format
-    image_file = request.files['picture']
-    image_format = image_file.filename.split('.')[-1].upper()
-    
-    if image_format == 'JPG':
-        image_format = 'JPEG'
-
-    # Generate a unique folder name based on the current epoch time
-    epoch_time = int(time.time())
-    folder_name = os.path.join(UPLOAD_FOLDER, str(epoch_time))
-    os.makedirs(folder_name, exist_ok=True)
-
-    # Save the image to the folder
-    image = Image.open(image_file)
-    filename = f"{epoch_time}.{image_format.lower()}"
-    image_path = os.path.join(folder_name, filename)
-    image.save(image_path, format=image_format.upper())
-
-    # Read the image using OpenCV
-    img = cv2.imread(image_path)
-    if img is None:
-        try:
-            shutil.rmtree(folder_name)
-        except Exception as e:
-            print(f"Error: {e}")
-        return jsonify({"message": "Gambar tidak dapat dibaca"}), 400
-
+# Run the face-shape pipeline on a decoded BGR image, returns (prediction, confidence) or None if no face is found.
+# timings, if given, receives the seconds each stage took
+def predict_face_shape(img, timings=None):
     # Detect facial landmarks in the image
-    landmarks = detect_facial_landmarks(img)
+    landmarks = detect_facial_landmarks(img, timings)
     if landmarks is None:
-        try:
-            shutil.rmtree(folder_name)
-        except Exception as e:
-            print(f"Error: {e}")
-        return jsonify({"message": "Tidak ada wajah yang terdeksi"}), 400
+        return None
 
     # Extract features from the landmarks and scale them
-    features = extract_features_from_landmarks(landmarks)
-    features_scaled = scaler.transform([features])
+    with timed(timings, "features"):
+        features = extract_features_from_landmarks(landmarks)
+    with timed(timings, "scale"):
+        features_scaled = scaler.transform([features])
 
     # Make the prediction using the model
-    prediction = model.predict(features_scaled)
+    with timed(timings, "predict"):
+        prediction = model.predict(features_scaled)
     confidence = None
     if hasattr(model, "predict_proba"):
-        probas = model.predict_proba(features_scaled)
+        with timed(timings, "predict_proba"):
+            probas = model.predict_proba(features_scaled)
         confidence = probas.max()  # Get the maximum probability
 
     # Ensure the prediction and confidence are serializable
     prediction = prediction.item() if isinstance(prediction, np.ndarray) else prediction
     confidence = confidence.item() if isinstance(confidence, np.ndarray) else confidence
+
+    if confidence is not None:
+        confidence = round(confidence, 2)
+
+    return prediction, confidence
+
+# Save an uploaded picture (an object with .filename, e.g. a FileStorage) to a temporary folder and
+# read it back with OpenCV, returns the BGR image or None if it can't be read
+def read_uploaded_image(image_file, timings=None):
+    # Extract the image format
+    image_format = image_file.filename.split('.')[-1].upper()
     
-    confidence = round(confidence, 2)
-    
+    if image_format == 'JPG':
+        image_format = 'JPEG'
+
+    # A folder of its own per upload, concurrent uploads never share one
+    folder_name = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
+
+    # Save the image to the folder
+    with timed(timings, "save"):
+        image = Image.open(image_file)
+        filename = f"upload.{image_format.lower()}"
+        image_path = os.path.join(folder_name, filename)
+        image.save(image_path, format=image_format.upper())
+
+    # Read the image using OpenCV
+    with timed(timings, "decode"):
+        img = cv2.imread(image_path)
+
     try:
         shutil.rmtree(folder_name)
     except Exception as e:
         print(f"Error: {e}")
+
+    return img
+
+# Save, decode and predict an uploaded picture, returns (prediction, confidence, error message)
+def predict_uploaded_image(image_file):
+    # Make sure the model artifacts are available in this process
+    load_model()
+
+    img = read_uploaded_image(image_file)
+    if img is None:
+        return None, None, "Gambar tidak dapat dibaca"
+
+    # Return the cached result when the same picture was already predicted
+    cache_key = prediction_cache.make_key(img, model_version)
+    cached = prediction_cache.get(cache_key)
+
+    if cached is not None:
+        prediction, confidence = cached
+        return prediction, confidence, None
+
+    result = predict_face_shape(img)
+    if result is None:
+        return None, None, "Tidak ada wajah yang terdeksi"
+
+    prediction, confidence = result
+    prediction_cache.put(cache_key, prediction, confidence)
+
+    return prediction, confidence, None
+
+@model_bp.route("/predict", methods=["POST"])
+def predict():
+    # Check if the image file is provided in the request
+    if 'picture' not in request.files:
+        return jsonify({"message": "Tidak ada gambar yang diupload"}), 400
+
+    prediction, confidence, error = predict_uploaded_image(request.files['picture'])
+    if error:
+        return jsonify({"message": error}), 400
     
     return jsonify({
         "message": "Image uploaded successfully",
         "prediction": prediction,
         "confidence": confidence if confidence is not None else None
     }), 200
+
+# Recommend products for a face shape, either predicted from an uploaded picture or given directly
+@model_bp.route("/recommend", methods=["GET", "POST"])
+def recommend_products():
+    page = int(request.args.get("page", 1))  # Default to page 1 if not provided
+    limit = int(request.args.get("limit", 10))  # Default to 10 items per page if not provided
+
+    confidence = None
+    if 'picture' in request.files:
+        face_shape, confidence, error = predict_uploaded_image(request.files['picture'])
+        if error:
+            return jsonify({"message": error}), 400
+    else:
+        face_shape = request.values.get("face_shape")
+
+    if not face_shape:
+        return jsonify({"message": "Upload gambar atau isi face_shape"}), 400
+
+    products_list, total_count = recommendation.recommend(face_shape, limit=limit, offset=(page - 1) * limit)
+
+    # Check if there are more items to load
+    has_more = (page * limit) < total_count
+    next_page = page + 1 if has_more else None
+    remaining_products = total_count - (page * limit) if has_more else 0
+
+    return jsonify({
+        "prediction": face_shape,
+        "confidence": confidence,
+        "products": products_list,
+        "has_more": has_more,
+        "next_page": next_page,
+        "remaining_products": remaining_products
+    }), 200
+
+# Prediction cache hit/miss counters (only admin)
+@model_bp.route("/cache/stats", methods=["GET"])
+@role_required("admin")
+def get_prediction_cache_stats():
+    return jsonify(prediction_cache.stats()), 200
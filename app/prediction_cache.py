@@ -0,0 +1,123 @@
+from pymongo import MongoClient, errors
+from collections import OrderedDict
+from dotenv import load_dotenv
+import os
+import datetime
+import hashlib
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+prediction_cache_collection = db["prediction_cache"]
+
+# In-memory LRU size and optional persistent (Mongo) tier
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 1024))
+PREDICTION_CACHE_MONGO = os.getenv("PREDICTION_CACHE_MONGO", "false").lower() == "true"
+PREDICTION_CACHE_TTL = int(os.getenv("PREDICTION_CACHE_TTL", 7 * 24 * 60 * 60))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "mongo_hits": 0, "evictions": 0}
+_index_ready = False
+
+# Build the cache key from the decoded pixels and the model version, so the same
+# picture re-encoded or re-uploaded maps to the same entry and a new model never reuses old results
+def make_key(img, model_version):
+    digest = hashlib.sha256()
+    digest.update(str(model_version).encode("utf-8"))
+    digest.update(str(img.shape).encode("utf-8"))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def _ensure_index():
+    global _index_ready
+
+    if _index_ready:
+        return
+
+    try:
+        # Let Mongo expire old persistent entries by itself
+        prediction_cache_collection.create_index("created_at", expireAfterSeconds=PREDICTION_CACHE_TTL)
+    except errors.PyMongoError as e:
+        print(f"Error creating prediction cache index: {e}")
+
+    _index_ready = True
+
+def _remember(key, result):
+    with _lock:
+        _cache[key] = result
+        _cache.move_to_end(key)
+
+        while len(_cache) > PREDICTION_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+# Return the cached (prediction, confidence) for a key, or None on a miss
+def get(key):
+    with _lock:
+        result = _cache.get(key)
+
+        if result is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return result
+
+    if PREDICTION_CACHE_MONGO:
+        try:
+            document = prediction_cache_collection.find_one({"_id": key})
+        except errors.PyMongoError as e:
+            print(f"Error reading prediction cache: {e}")
+            document = None
+
+        if document:
+            result = (document["prediction"], document.get("confidence"))
+            _remember(key, result)
+
+            with _lock:
+                _stats["hits"] += 1
+                _stats["mongo_hits"] += 1
+
+            return result
+
+    with _lock:
+        _stats["misses"] += 1
+
+    return None
+
+# Store a prediction in memory and, when enabled, in the persistent tier
+def put(key, prediction, confidence):
+    _remember(key, (prediction, confidence))
+
+    if PREDICTION_CACHE_MONGO:
+        _ensure_index()
+
+        try:
+            prediction_cache_collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "prediction": prediction,
+                    "confidence": confidence,
+                    "created_at": datetime.datetime.now(datetime.timezone.utc)
+                }},
+                upsert=True
+            )
+        except errors.PyMongoError as e:
+            print(f"Error writing prediction cache: {e}")
+
+# Hit/miss counters for monitoring
+def stats():
+    with _lock:
+        return {
+            **_stats,
+            "size": len(_cache),
+            "max_size": PREDICTION_CACHE_SIZE,
+            "mongo_enabled": PREDICTION_CACHE_MONGO
+        }
+
+def clear():
+    with _lock:
+        _cache.clear()
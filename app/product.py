@@ -1,10 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, InsertOne, UpdateOne, errors
 from bson.objectid import ObjectId
 from functools import wraps
 from dotenv import load_dotenv
+from . import http_cache, single_flight, async_db, catalog_events, catalog_snapshot, leaderboard, suggest, similar
+from .sparse_fields import sparse_projection
 import os
+import io
+import csv
+import json
+import datetime
+import asyncio
 
 # Load environment variables from .env file
 load_dotenv()
@@ -25,7 +32,7 @@ def role_required(role):
         @jwt_required()
         def decorated_function(*args, **kwargs):
             current_user = get_jwt_identity()
-            user = users.find_one({"_id": ObjectId(current_user)})
+            user = users.find_one({"_id": ObjectId(current_user)}, {"role": 1})
             
             if not user:
                 return jsonify({"message": "User not found"}), 404
@@ -37,52 +44,94 @@ def role_required(role):
         return decorated_function
     return wrapper
 
-# Helper function to format product data
-def format_product(product):
+# Fields returned by the product detail endpoint, with the value used when a product doesn't have one
+PRODUCT_DETAIL_DEFAULTS = {
+    "bridge": None,
+    "color": None,
+    "color_name": None,
+    "created_at": None,
+    "description": None,
+    "features": [],
+    "frame_width": None,
+    "images": [],
+    "lens_height": None,
+    "lens_width": None,
+    "material": [],
+    "name": None,
+    "price": None,
+    "rating": None,
+    "reviews": [],
+    "rim": None,
+    "shape": None,
+    "size": None,
+    "sold": None,
+    "stock": None,
+    "temple_length": None,
+    "weight": None
+}
+PRODUCT_DETAIL_PROJECTION = {field: 1 for field in PRODUCT_DETAIL_DEFAULTS}
+
+# Fields returned by the product listing endpoints
+PRODUCT_LIST_PROJECTION = {
+    "_id": 1,
+    "name": 1,
+    "price": 1,
+    "sold": 1,
+    "review_count": {"$size": "$reviews"},  # Direct projection for review count
+    "rating": 1,
+    "images": {"$slice": [{"$ifNull": ["$images", []]}, 1]}  # Only the first image
+}
+PRODUCT_DATED_LIST_PROJECTION = {**PRODUCT_LIST_PROJECTION, "created_at": 1}
+
+# Reviewer lookups are independent, the async driver runs them concurrently
+async def find_reviewers_async(user_ids):
+    collection = async_db.collection("users")
+    found = await asyncio.gather(*(
+        collection.find_one({"_id": user_id}, {"name": 1, "photo_profile": 1}) for user_id in user_ids
+    ))
+    return dict(zip(user_ids, found))
+
+# Helper function to format product data (fetched with PRODUCT_DETAIL_PROJECTION or a sparse subset of it)
+def format_product(product, projection=PRODUCT_DETAIL_PROJECTION):
+    reviewers = None
+    if async_db.ASYNC_MONGO and product.get('reviews'):
+        reviewers = async_db.run(find_reviewers_async, list({ObjectId(review['user_id']) for review in product['reviews']}))
+
     # Format the reviews by adding user information
-    reviews = []
     for review in product.get('reviews', []):
         # Fetch the user who posted the review
-        user = users.find_one({"_id": ObjectId(review['user_id'])})
+        if reviewers is not None:
+            user = reviewers.get(ObjectId(review['user_id']))
+        else:
+            user = users.find_one({"_id": ObjectId(review['user_id'])}, {"name": 1, "photo_profile": 1})
         
         # If user is found, add their name and photo_profile to the review
         if user:
-            review["user_id"] = str(review["user_id"])
             review['user_name'] = user.get('name')
             review['user_avatar'] = user.get('photo_profile')
         else:
             # If user not found, we can set defaults or leave empty
             review['user_name'] = 'Unknown User'
             review['user_avatar'] = None
-        
-        reviews.append(review)
-
-    # Return the product with all fields and formatted reviews
-    return {
-        "_id": str(product["_id"]),
-        "bridge": product.get("bridge"),
-        "color": product.get("color"),
-        "color_name": product.get("color_name"),
-        "created_at": product.get("created_at"),
-        "description": product.get("description"),
-        "features": product.get("features", []),
-        "frame_width": product.get("frame_width"),
-        "images": product.get("images", []),
-        "lens_height": product.get("lens_height"),
-        "lens_width": product.get("lens_width"),
-        "material": product.get("material", []),
-        "name": product.get("name"),
-        "price": product.get("price"),
-        "rating": product.get("rating"),
-        "reviews": reviews,  # Include formatted reviews
-        "rim": product.get("rim"),
-        "shape": product.get("shape"),
-        "size": product.get("size"),
-        "sold": product.get("sold"),
-        "stock": product.get("stock"),
-        "temple_length": product.get("temple_length"),
-        "weight": product.get("weight")
-    }
+
+    # Fill in the requested fields the product doesn't have, ObjectIds and dates are encoded by the JSON provider
+    for field, default in PRODUCT_DETAIL_DEFAULTS.items():
+        if field in projection and field not in product:
+            product[field] = default
+
+    return product
+
+# Fields every new product must provide
+PRODUCT_REQUIRED_FIELDS = ("name", "shape", "material", "color", "price", "description", "stock", "face_shape", "images")
+
+# Optional catalog fields accepted on import
+PRODUCT_OPTIONAL_FIELDS = ("sold", "size", "rim", "weight", "features", "color_name", "frame_width", "bridge", "lens_width", "lens_height", "temple_length")
+
+# Fields an admin can change on an existing product (single and bulk updates)
+PRODUCT_UPDATE_FIELDS = ("name", "shape", "material", "color", "price", "description", "stock", "face_shape", "images")
+
+# Rows per bulk_write during import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
 
 # Create new product (only admin)
 @products_bp.route("/", methods=["POST"])
@@ -90,7 +139,7 @@ def format_product(product):
 def create_product():
     data = request.get_json()
 
-    if not data or not all(field in data for field in ("name", "shape", "material", "color", "price", "description", "stock", "face_shape", "images")):
+    if not data or not all(field in data for field in PRODUCT_REQUIRED_FIELDS):
         return jsonify({"message": "Missing fields"}), 400
     
     name = data["name"]
@@ -118,48 +167,267 @@ def create_product():
         "face_shape": face_shape,
         "images": images,
         "reviews": reviews,
-        "rating": rating
+        "rating": rating,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        "updated_at": datetime.datetime.now(datetime.timezone.utc),
+        "version": 1
     }).inserted_id
 
+    # Keep the in-process indexes and the listing ETags in sync
+    catalog_events.products_created([product_id])
+
     return jsonify({"message": "Product created", "_id": str(product_id)}), 201
 
+# CSV columns used by export (and accepted by import); list values are joined with "|"
+CSV_COLUMNS = ("_id",) + PRODUCT_REQUIRED_FIELDS + PRODUCT_OPTIONAL_FIELDS
+CSV_LIST_FIELDS = ("material", "color", "color_name", "face_shape", "images", "features")
+CSV_NUMBER_FIELDS = ("price", "stock", "sold", "frame_width", "bridge", "lens_width", "lens_height", "temple_length")
+
+# Convert a CSV row (all strings) to the same types a JSON row would have
+def parse_csv_row(row):
+    data = {}
+
+    for field, value in row.items():
+        if field is None or value is None or value == "":
+            continue
+
+        if field in CSV_LIST_FIELDS:
+            data[field] = [item for item in value.split("|") if item]
+        elif field in CSV_NUMBER_FIELDS:
+            number = float(value)
+            data[field] = int(number) if number.is_integer() else number
+        else:
+            data[field] = value
+
+    return data
+
+# Read the request body row by row without loading it all in memory
+def read_import_rows():
+    if "csv" in (request.content_type or ""):
+        reader = csv.DictReader(io.TextIOWrapper(request.stream, encoding="utf-8"))
+
+        for row in reader:
+            try:
+                yield parse_csv_row(row), None
+            except ValueError as e:
+                yield None, f"Invalid number: {e}"
+    else:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield None, f"Invalid JSON: {e}"
+                continue
+
+            yield data, None
+
+# Validate one imported row and build its write, returns (operation, error)
+def build_import_operation(data):
+    if not isinstance(data, dict):
+        return None, "Row must be an object"
+
+    fields = {field: data[field] for field in PRODUCT_REQUIRED_FIELDS + PRODUCT_OPTIONAL_FIELDS if field in data}
+    missing = [field for field in PRODUCT_REQUIRED_FIELDS if field not in data]
+
+    # Rows with an _id update that product (e.g. an edited export); only complete rows may create it,
+    # partial ones just update an existing product
+    if data.get("_id"):
+        try:
+            product_id = ObjectId(data["_id"])
+        except (errors.InvalidId, TypeError):
+            return None, "Invalid ID format"
+
+        if not fields:
+            return None, "No valid fields provided for update"
+
+        return UpdateOne(
+            {"_id": product_id},
+            http_cache.with_product_changed({
+                "$set": fields,
+                "$setOnInsert": {"reviews": [], "rating": 0, "created_at": datetime.datetime.now(datetime.timezone.utc)}
+            }),
+            upsert=not missing
+        ), None
+
+    if missing:
+        return None, f"Missing fields: {', '.join(missing)}"
+
+    return InsertOne({
+        **fields,
+        "sold": fields.get("sold", 0),
+        "reviews": [],
+        "rating": 0,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        "updated_at": datetime.datetime.now(datetime.timezone.utc),
+        "version": 1
+    }), None
+
+# Bulk import products from NDJSON or CSV (only admin)
+@products_bp.route("/import", methods=["POST"])
+@role_required("admin")
+def import_products():
+    inserted = 0
+    updated = 0
+    row_errors = []
+    batch = []
+    batch_rows = []
+    # (row, product id) of partial rows, which only update existing products
+    batch_partial = []
+
+    def flush():
+        nonlocal inserted, updated
+
+        try:
+            result = products.bulk_write(batch, ordered=False)
+            details = result.bulk_api_result
+        except errors.BulkWriteError as e:
+            details = e.details
+
+            for write_error in details.get("writeErrors", []):
+                row_errors.append({"row": batch_rows[write_error["index"]], "error": write_error.get("errmsg")})
+
+        inserted += details.get("nInserted", 0) + details.get("nUpserted", 0)
+        updated += details.get("nModified", 0)
+
+        if batch_partial:
+            found = set(products.distinct("_id", {"_id": {"$in": [product_id for _, product_id in batch_partial]}}))
+            for row_number, product_id in batch_partial:
+                if product_id not in found:
+                    row_errors.append({"row": row_number, "error": "Product not found (partial rows need an existing product)"})
+
+        batch.clear()
+        batch_rows.clear()
+        batch_partial.clear()
+
+    for row_number, (data, error) in enumerate(read_import_rows(), start=1):
+        operation = None
+        if not error:
+            operation, error = build_import_operation(data)
+
+        if error:
+            row_errors.append({"row": row_number, "error": error})
+            continue
+
+        batch.append(operation)
+        batch_rows.append(row_number)
+        if data.get("_id") and any(field not in data for field in PRODUCT_REQUIRED_FIELDS):
+            batch_partial.append((row_number, ObjectId(data["_id"])))
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+
+    if batch:
+        flush()
+
+    # One rebuild instead of updating the in-process indexes row by row
+    if inserted or updated:
+        catalog_events.catalog_reloaded()
+
+    return jsonify({
+        "message": "Import finished",
+        "inserted": inserted,
+        "updated": updated,
+        "failed": len(row_errors),
+        "errors": row_errors
+    }), 200
+
+# Make a product document JSON/CSV friendly
+def export_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+# Stream the whole catalog as NDJSON or CSV (only admin)
+@products_bp.route("/export", methods=["GET"])
+@role_required("admin")
+def export_products():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"message": "format must be ndjson or csv"}), 400
+
+    projection = {field: 1 for field in CSV_COLUMNS}
+    cursor = products.find({}, projection, batch_size=IMPORT_BATCH_SIZE)
+
+    def generate_ndjson():
+        for product in cursor:
+            yield json.dumps({field: export_value(value) for field, value in product.items()}) + "\n"
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+
+        for product in cursor:
+            writer.writerow({
+                field: "|".join(str(item) for item in value) if isinstance(value, list) else export_value(value)
+                for field, value in product.items()
+            })
+
+            # Send the buffered rows once they are big enough for a chunk
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    if export_format == "csv":
+        return Response(stream_with_context(generate_csv()), mimetype="text/csv", headers={
+            "Content-Disposition": "attachment; filename=products.csv"
+        })
+
+    return Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson", headers={
+        "Content-Disposition": "attachment; filename=products.ndjson"
+    })
+
+# Page query and total count are independent, the async driver runs them concurrently
+async def find_page_async(query, projection, sort_field, skip, limit):
+    collection = async_db.collection("products")
+    cursor = collection.find(query, projection)
+    if sort_field:
+        # Ties in _id order, like the in-memory leaderboards and catalog
+        cursor = cursor.sort([sort_field, ("_id", 1)])
+
+    return await asyncio.gather(
+        cursor.skip(skip).limit(limit).to_list(length=limit),
+        collection.count_documents(query)
+    )
+
+# Return one page of products matching the query and the total number of matches
+def find_page(query, projection, sort_field, page, limit):
+    if async_db.ASYNC_MONGO:
+        return async_db.run(find_page_async, query, projection, sort_field, (page - 1) * limit, limit)
+
+    cursor = products.find(query, projection).skip((page - 1) * limit).limit(limit)
+    if sort_field:
+        # Ties in _id order, like the in-memory leaderboards and catalog
+        cursor = cursor.sort([sort_field, ("_id", 1)])
+
+    return list(cursor), products.count_documents(query)
+
 # Get all products
 @products_bp.route("/", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.catalog_validators)
 def get_all_products():
     # Get query parameters
     page = int(request.args.get("page", 1))  # Default to page 1 if not provided
     limit = int(request.args.get("limit", 10))  # Default to 10 items per page if not provided
 
     # MongoDB query to select only the required fields
-    projection = {
-        "_id": 1,
-        "name": 1,
-        "price": 1,
-        "sold": 1,
-        "review_count": {"$size": "$reviews"},  # Direct projection for review count
-        "rating": 1,
-        "images": 1
-    }
+    projection = sparse_projection(PRODUCT_LIST_PROJECTION)
 
     # Query the database with projection, skip, and limit for pagination
-    cursor = products.find({}, projection).skip((page - 1) * limit).limit(limit)
-
-    # Convert MongoDB cursor to a list of dictionaries containing only the required fields
-    products_list = [
-        {
-            "_id": str(product["_id"]),
-            "name": product["name"],
-            "price": product["price"],
-            "sold": product["sold"],
-            "review_count": product.get("review_count", 0),  # Ensure a valid count
-            "rating": product["rating"],
-            "images": product["images"][:1] if "images" in product else []
-        }
-        for product in cursor  # Corrected access to product within the loop
-    ]
+    # (the projection already shapes the documents, the JSON provider encodes ObjectIds)
+    products_list, total_count = find_page({}, projection, None, page, limit)
 
     # Check if there are more items to load
-    total_count = products.count_documents({})  # Total number of documents
     has_more = (page * limit) < total_count
     next_page = page + 1 if has_more else None
     remaining_products = total_count - (page * limit) if has_more else 0
@@ -174,41 +442,24 @@ def get_all_products():
     
 # Get Best selling product
 @products_bp.route("/best-seller", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.catalog_validators)
 def get_best_selling_products():
     # Get query parameters
     page = int(request.args.get("page", 1))  # Default to page 1 if not provided
     limit = int(request.args.get("limit", 10))  # Default to 10 items per page if not provided
 
     # MongoDB query to select only the required fields
-    projection = {
-        "_id": 1,
-        "name": 1,
-        "price": 1,
-        "sold": 1,
-        "review_count": {"$size": "$reviews"},  # Direct projection for review count
-        "rating": 1,
-        "images": 1
-    }
-
-    # Sort by 'sold' in descending order to get best sellers first
-    cursor = products.find({}, projection).sort("sold", -1).skip((page - 1) * limit).limit(limit)
-
-    # Convert MongoDB cursor to a list of dictionaries containing only the required fields
-    products_list = [
-        {
-            "_id": str(product["_id"]),
-            "name": product["name"],
-            "price": product["price"],
-            "sold": product["sold"],
-            "review_count": product.get("review_count", 0),  # Ensure a valid count
-            "rating": product["rating"],
-            "images": product["images"][:1] if "images" in product else []
-        }
-        for product in cursor  # Corrected access to product within the loop
-    ]
+    projection = sparse_projection(PRODUCT_LIST_PROJECTION)
+
+    # Sort by 'sold' in descending order to get best sellers first; served by the in-memory catalog when
+    # enabled, else the first pages come from the leaderboard; deeper pages and sparse fieldsets from Mongo
+    result = None
+    if "fields" not in request.args:
+        result = catalog_snapshot.search({}, ("sold", -1), page, limit, projection) or leaderboard.page("sold", page, limit)
+    products_list, total_count = result or find_page({}, projection, ("sold", -1), page, limit)
 
     # Check if there are more items to load
-    total_count = products.count_documents({})  # Total number of documents
     has_more = (page * limit) < total_count
     next_page = page + 1 if has_more else None
     remaining_products = total_count - (page * limit) if has_more else 0
@@ -222,43 +473,24 @@ def get_best_selling_products():
     }), 200
     
 @products_bp.route("/latest", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.catalog_validators)
 def get_newest_products():
     # Get query parameters
     page = int(request.args.get("page", 1))  # Default to page 1 if not provided
     limit = int(request.args.get("limit", 10))  # Default to 10 items per page if not provided
 
     # MongoDB query to select only the required fields
-    projection = {
-        "_id": 1,
-        "name": 1,
-        "price": 1,
-        "sold": 1,
-        "review_count": {"$size": "$reviews"},  # Direct projection for review count
-        "rating": 1,
-        "created_at": 1,
-        "images": 1
-    }
-
-    # Sort by 'created_at' in descending order to get newest items first
-    cursor = products.find({}, projection).sort("created_at", -1).skip((page - 1) * limit).limit(limit)
-
-    # Convert MongoDB cursor to a list of dictionaries containing only the required fields
-    products_list = [
-        {
-            "_id": str(product["_id"]),
-            "name": product["name"],
-            "price": product["price"],
-            "sold": product["sold"],
-            "review_count": product.get("review_count", 0),  # Ensure a valid count
-            "rating": product["rating"],
-            "created_at": product["created_at"],
-            "images": product["images"][:1] if "images" in product else []
-        }
-        for product in cursor  # Corrected access to product within the loop
-    ]
+    projection = sparse_projection(PRODUCT_DATED_LIST_PROJECTION)
+
+    # Sort by 'created_at' in descending order to get newest items first; served by the in-memory catalog
+    # when enabled, else the first pages come from the leaderboard; deeper pages and sparse fieldsets from Mongo
+    result = None
+    if "fields" not in request.args:
+        result = catalog_snapshot.search({}, ("created_at", -1), page, limit, projection) or leaderboard.page("created_at", page, limit)
+    products_list, total_count = result or find_page({}, projection, ("created_at", -1), page, limit)
 
     # Check if there are more items to load
-    total_count = products.count_documents({})  # Total number of documents
     has_more = (page * limit) < total_count
     next_page = page + 1 if has_more else None
     remaining_products = total_count - (page * limit) if has_more else 0
@@ -272,9 +504,11 @@ def get_newest_products():
     }), 200
 
 @products_bp.route("/search", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.catalog_validators)
 def search_products():
     # Get query parameters
-    query = request.args.get("query")  # Search by name
+    search_query = request.args.get("query")  # Search by name or shape
     features_query = request.args.getlist("features")  # Search by multiple features
     rating_query = request.args.get("rating")  # Filter by rating
     rim_query = request.args.get("rim")  # Filter by rim type
@@ -288,9 +522,11 @@ def search_products():
     # MongoDB query to build
     query = {}
 
-    if query:
-        query["name"] = {"$regex": query, "$options": "i"}  # Case insensitive match for name
-        query["shape"] = {"$regex": query, "$options": "i"}  # Case insensitive match for shape
+    if search_query:
+        query["$or"] = [
+            {"name": {"$regex": search_query, "$options": "i"}},  # Case insensitive match for name
+            {"shape": {"$regex": search_query, "$options": "i"}}  # or shape
+        ]
     if features_query:
         query["features"] = {"$in": features_query}  # Match any of the features
     if rating_query:
@@ -316,38 +552,24 @@ def search_products():
         sort_field = ("created_at", -1)  # Sort by creation date latest first
 
     # MongoDB query with projection, skip, limit, and sorting
-    projection = {
-        "_id": 1,
-        "name": 1,
-        "price": 1,
-        "sold": 1,
-        "review_count": {"$size": "$reviews"},  # Direct projection for review count
-        "rating": 1,
-        "created_at": 1,
-        "images": 1
-    }
-
-    cursor = products.find(query, projection).skip((page - 1) * limit).limit(limit)
-    if sort_field:
-        cursor = cursor.sort(*sort_field)
-
-    # Convert MongoDB cursor to a list of dictionaries containing only the required fields
-    products_list = [
-        {
-            "_id": str(product["_id"]),
-            "name": product["name"],
-            "price": product["price"],
-            "sold": product["sold"],
-            "review_count": product.get("review_count", 0),  # Ensure a valid count
-            "rating": product["rating"],
-            "created_at": product["created_at"],
-            "images": product["images"][:1] if "images" in product else []
-        }
-        for product in cursor  # Corrected access to product within the loop
-    ]
+    projection = sparse_projection(PRODUCT_DATED_LIST_PROJECTION)
+
+    # Same filters against the in-memory catalog when enabled, sparse fieldsets always read Mongo
+    result = None
+    if "fields" not in request.args:
+        result = catalog_snapshot.search({
+            "query": search_query,
+            "features": features_query,
+            "rating": float(rating_query) if rating_query else None,
+            "rim": rim_query,
+            "size": size_query,
+            "weight": weight_query,
+            "material": material_query
+        }, sort_field, page, limit, projection)
+
+    products_list, total_count = result or find_page(query, projection, sort_field, page, limit)
 
     # Check if there are more items to load
-    total_count = products.count_documents(query)  # Total number of documents matching the query
     has_more = (page * limit) < total_count
     next_page = page + 1 if has_more else None
     remaining_products = total_count - (page * limit) if has_more else 0
@@ -360,59 +582,137 @@ def search_products():
         "remaining_products": remaining_products
     }), 200
 
+# Autocomplete for the search box: best selling products with a name word starting with q, and matching shapes
+@products_bp.route("/suggest", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(suggest.validators)
+def suggest_products():
+    prefix = request.args.get("q", "")
+    limit = int(request.args.get("limit", 10))  # Default to 10 suggestions if not provided
+
+    # Served from the in-memory prefix index, no Mongo query per keystroke
+    names, shapes = suggest.suggest(prefix, limit)
+
+    return jsonify({
+        "products": names,
+        "shapes": shapes
+    }), 200
 
 # Get product by ID
 @products_bp.route("/<id>", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.product_validators)
 def get_product(id):
     try:
-        product = products.find_one({"_id": ObjectId(id)})
+        projection = sparse_projection(PRODUCT_DETAIL_PROJECTION)
+        product = products.find_one({"_id": ObjectId(id)}, projection)
         if product:
-            return jsonify(format_product(product)), 200
+            return jsonify(format_product(product, projection)), 200
         else:
             return jsonify({"message": "Product not found"}), 404
 
     except errors.InvalidId:
         return jsonify({"message": "Invalid ID format"}), 400
 
+# Products with the closest attributes ("you may also like"), precomputed by `python -m app.similar build`
+@products_bp.route("/<id>/similar", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(similar.validators)
+def get_similar_products(id):
+    limit = int(request.args.get("limit", 10))  # Default to 10 products if not provided
+
+    products_list = similar.similar(id, min(limit, similar.SIMILAR_NEIGHBORS))
+    if products_list is None:
+        return jsonify({"message": "Product not found"}), 404
+
+    return jsonify({"products": products_list}), 200
+
 # Update product (only admin)
 @products_bp.route("/<id>", methods=["PUT"])
 @role_required("admin")
 def update_product(id):
     data = request.get_json()
-    update_fields = {}
-
-    if "name" in data:
-        update_fields["name"] = data["name"]
-    if "shape" in data:
-        update_fields["shape"] = data["shape"]
-    if "material" in data:
-        update_fields["material"] = data["material"]
-    if "color" in data:
-        update_fields["color"] = data["color"]
-    if "price" in data:
-        update_fields["price"] = data["price"]
-    if "description" in data:
-        update_fields["description"] = data["description"]
-    if "stock" in data:
-        update_fields["stock"] = data["stock"]
-    if "face_shape" in data:
-        update_fields["face_shape"] = data["face_shape"]
-    if "images" in data:
-        update_fields["images"] = data["images"]
-        
+    update_fields = {field: data[field] for field in PRODUCT_UPDATE_FIELDS if field in data}
 
     if update_fields:
         result = products.update_one(
             {"_id": ObjectId(id)},
-            {"$set": update_fields}
+            http_cache.with_product_changed({"$set": update_fields})
         )
 
         if result.modified_count > 0:
+            catalog_events.products_changed([id])
             return jsonify({"message": "Product updated"}), 200
         else:
             return jsonify({"message": "No changes made or product not found"}), 404
     else:
         return jsonify({"message": "No valid fields provided for update"}), 400
+
+# Patch many products at once (only admin)
+# Body: [{"id": ..., "fields": {...}}, ...], fields limited to what update_product accepts
+@products_bp.route("/bulk", methods=["PATCH"])
+@role_required("admin")
+def bulk_update_products():
+    patches = request.get_json()
+
+    if not isinstance(patches, list) or not patches:
+        return jsonify({"message": "Body must be a non-empty list of {id, fields} patches"}), 400
+
+    results = []
+    # product_id -> merged fields, several patches for one product apply in request order
+    updates = {}
+
+    for patch in patches:
+        product_id = patch.get("id") if isinstance(patch, dict) else None
+        fields = patch.get("fields") if isinstance(patch, dict) else None
+
+        try:
+            object_id = ObjectId(product_id)
+        except (errors.InvalidId, TypeError):
+            results.append({"id": product_id, "status": "error", "error": "Invalid ID format"})
+            continue
+
+        update_fields = {field: fields[field] for field in PRODUCT_UPDATE_FIELDS if field in fields} if isinstance(fields, dict) else {}
+        if not update_fields:
+            results.append({"id": product_id, "status": "error", "error": "No valid fields provided for update"})
+            continue
+
+        updates.setdefault(object_id, {}).update(update_fields)
+
+    # Which products exist decides each outcome, every matched update changes version/updated_at
+    found = {product["_id"] for product in products.find({"_id": {"$in": list(updates)}}, {"_id": 1})} if updates else set()
+
+    operation_ids = [product_id for product_id in updates if product_id in found]
+    failed_ids = set()
+
+    if operation_ids:
+        try:
+            products.bulk_write([
+                UpdateOne({"_id": product_id}, http_cache.with_product_changed({"$set": updates[product_id]}))
+                for product_id in operation_ids
+            ], ordered=False)
+        except errors.BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                product_id = operation_ids[write_error["index"]]
+                failed_ids.add(product_id)
+                results.append({"id": str(product_id), "status": "error", "error": write_error.get("errmsg")})
+
+    updated_ids = [product_id for product_id in updates if product_id in found and product_id not in failed_ids]
+    results.extend({"id": str(product_id), "status": "updated"} for product_id in updated_ids)
+    results.extend({"id": str(product_id), "status": "not_found"} for product_id in updates if product_id not in found)
+
+    # One index/ETag invalidation for the whole batch, a rebuild when it touched a large part of the catalog
+    if len(updated_ids) > IMPORT_BATCH_SIZE:
+        catalog_events.catalog_reloaded()
+    elif updated_ids:
+        catalog_events.products_changed(updated_ids)
+
+    return jsonify({
+        "message": "Bulk update finished",
+        "updated": len(updated_ids),
+        "failed": len(results) - len(updated_ids),
+        "results": results
+    }), 200
     
 # Delete product by ID
 @products_bp.route("/<id>", methods=["DELETE"])
@@ -421,6 +721,7 @@ def delete_product(id):
     result = products.delete_one({"_id": ObjectId(id)})
 
     if result.deleted_count > 0:
+        catalog_events.product_removed(id)
         return jsonify({"message": "Product deleted"}), 200
     else:
         return jsonify({"message": "Product not found"}), 404
\ No newline at end of file
@@ -0,0 +1,131 @@
+from pymongo import MongoClient
+from bisect import insort, bisect_left
+from dotenv import load_dotenv
+import os
+import time
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+
+# Full rebuild interval, picks up writes made by other worker processes
+RECOMMENDATION_REFRESH_SECONDS = int(os.getenv("RECOMMENDATION_REFRESH_SECONDS", 300))
+
+# Fields kept in memory for each recommended product
+projection = {
+    "_id": 1,
+    "name": 1,
+    "price": 1,
+    "sold": 1,
+    "review_count": {"$size": {"$ifNull": ["$reviews", []]}},
+    "rating": 1,
+    "images": 1,
+    "face_shape": 1
+}
+
+# face_shape (lowercase) -> ranking list of (-sold, -rating, product_id), best first
+_rankings = {}
+# product_id -> (face shapes, ranking key, summary)
+_entries = {}
+_lock = threading.Lock()
+_built_at = None
+
+def _face_shapes(product):
+    face_shape = product.get("face_shape")
+
+    if not face_shape:
+        return []
+    if isinstance(face_shape, str):
+        face_shape = [face_shape]
+
+    return list({str(shape).lower() for shape in face_shape})
+
+def _summary(product):
+    return {
+        "_id": str(product["_id"]),
+        "name": product.get("name"),
+        "price": product.get("price"),
+        "sold": product.get("sold", 0),
+        "review_count": product.get("review_count", 0),
+        "rating": product.get("rating", 0),
+        "images": product.get("images", [])[:1]
+    }
+
+# Must be called with _lock held when used on the live index
+def _remove(rankings, entries, product_id):
+    entry = entries.pop(product_id, None)
+    if not entry:
+        return
+
+    shapes, key, _ = entry
+    for shape in shapes:
+        ranking = rankings.get(shape, [])
+        index = bisect_left(ranking, key)
+        if index < len(ranking) and ranking[index] == key:
+            ranking.pop(index)
+
+# Must be called with _lock held when used on the live index
+def _insert(rankings, entries, product):
+    product_id = str(product["_id"])
+    shapes = _face_shapes(product)
+    if not shapes:
+        return
+
+    summary = _summary(product)
+    key = (-(summary["sold"] or 0), -(summary["rating"] or 0), product_id)
+    entries[product_id] = (shapes, key, summary)
+
+    for shape in shapes:
+        insort(rankings.setdefault(shape, []), key)
+
+# Rebuild the whole index from Mongo
+def rebuild():
+    global _rankings, _entries, _built_at
+
+    # Build the new index outside the lock, readers keep using the old one meanwhile
+    rankings = {}
+    entries = {}
+
+    for product in products.find({"face_shape": {"$exists": True}}, projection):
+        _insert(rankings, entries, product)
+
+    with _lock:
+        _rankings = rankings
+        _entries = entries
+        _built_at = time.monotonic()
+
+# Drop the index, it is rebuilt on next use
+def invalidate():
+    global _built_at
+
+    _built_at = None
+
+# Move changed products to their new ranking positions; documents are the changed
+# products re-read with (at least) this module's projection, deleted ones are missing
+def apply_changes(product_ids, documents):
+    if _built_at is None:
+        return
+
+    with _lock:
+        for product_id in product_ids:
+            _remove(_rankings, _entries, str(product_id))
+
+        for product in documents:
+            _insert(_rankings, _entries, product)
+
+# Top products for a face shape, a single in-memory lookup
+def recommend(face_shape, limit=10, offset=0):
+    if _built_at is None or time.monotonic() - _built_at > RECOMMENDATION_REFRESH_SECONDS:
+        rebuild()
+
+    with _lock:
+        ranking = _rankings.get(str(face_shape).lower(), [])
+        keys = ranking[offset:offset + limit]
+        total_count = len(ranking)
+
+        return [_entries[key[2]][2] for key in keys], total_count
@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from pymongo import MongoClient, errors
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
+from . import http_cache, single_flight, catalog_events, jobs
 import os
 import datetime
 
@@ -12,21 +13,30 @@ load_dotenv()
 # Initialize MongoDB client
 mongo_uri = os.getenv("MONGO_URI")
 client = MongoClient(mongo_uri)
-db = client.glassify
+db = client[os.getenv("MONGO_DB_NAME")]
 users = db["users"]
 products = db["products"]
 
 # Create a Blueprint for products
 reviews_bp = Blueprint('reviews', __name__)
 
-# Helper function to format product data
-def format_product(product):
-    product["_id"] = str(product["_id"])
+# recompute_rating job: average the product's reviews into its rating
+def recompute_rating(product_id):
+    result = next(products.aggregate([
+        {"$match": {"_id": product_id}},
+        {"$project": {"rating": {"$avg": "$reviews.rating"}}}
+    ]), None)
 
-    for review in product.get("reviews", []):
-        review["user_id"] = str(review["user_id"])
+    if not result or result.get("rating") is None:
+        return
 
-    return product
+    products.update_one(
+        {"_id": product_id},
+        http_cache.with_product_changed({"$set": {"rating": round(result["rating"], 1)}})
+    )
+
+    # Rating changed, update the in-process indexes and invalidate cached pages
+    catalog_events.products_changed([product_id])
 
 # Add review by product ID
 @reviews_bp.route("/<id>", methods=["POST"])
@@ -52,31 +62,29 @@ def add_review(id):
     }
 
     try:
-        product = products.find_one({"_id": ObjectId(id)})
-        if not product:
-            return jsonify({"error": "Product not found"}), 404
-        
-        products.update_one(
+        result = products.update_one(
             {"_id": ObjectId(id)},
-            {"$push": {"reviews": review}}
+            http_cache.with_product_changed({"$push": {"reviews": review}})
         )
     
     except errors.InvalidId:
         return jsonify({"error": "Invalid ID format"}), 400
-    
 
-    reviews = product.get("reviews", []) + [review]
-    total_rating = round(sum(r["rating"] for r in reviews) / len(reviews), 1)
+    if not result.matched_count:
+        return jsonify({"error": "Product not found"}), 404
 
-    products.update_one(
-        {"_id": ObjectId(id)},
-        {"$set": {"rating": total_rating}}
-    )
+    # The average rating is recomputed by a job worker
+    try:
+        jobs.enqueue("recompute_rating", product_id=ObjectId(id))
+    except errors.PyMongoError as e:
+        print(f"Error queueing rating recompute: {e}")
 
     return jsonify({"message": "Review added successfully"}), 201
 
 # Get all reviews from product
 @reviews_bp.route("/product/<id>", methods=["GET"])
+@single_flight.coalesce
+@http_cache.conditional(http_cache.product_validators)
 def get_all_product_reviews(id):
     product = products.find_one(
         {"_id": ObjectId(id)},
@@ -90,7 +98,7 @@ def get_all_product_reviews(id):
             reverse=True
         )
         
-        return jsonify(format_product(product)), 200
+        return jsonify(product), 200
     else:
         return jsonify({"error": "Product not found"}), 404
     
@@ -116,9 +124,7 @@ def get_reviews_by_rating(id):
             if review.get("rating") in rating_values
         ]
 
-        formatted_product = format_product(product)
-
-        return jsonify(formatted_product["reviews"]), 200
+        return jsonify(product["reviews"]), 200
     
     except ValueError:
         return jsonify({"error": "Ratings must be integers"}), 400
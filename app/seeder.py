@@ -1,11 +1,15 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from faker import Faker
 from pymongo import MongoClient
 from flask_bcrypt import Bcrypt
 from bson.objectid import ObjectId
+from multiprocessing import Pool
+import argparse
 import random
+import time
 import os
 from dotenv import load_dotenv
+from .indexes import ensure_collections
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,14 +22,17 @@ db = client[os.getenv("MONGO_DB_NAME")]
 users_collection = db["users"]
 products_collection = db["products"]
 transactions_collection = db["transactions"]
+carts_collection = db["carts"]
+wishlists_collection = db["wishlists"]
 
-faker = Faker()
+DEFAULT_PASSWORD = "@Verystrongpassword123"
 
 glasses_shape = ["Square", "Cat-Eye", "Round", "Rectangle", "Aviator", "Aviator", "Browline", "Geometric", "Oval", "Heart"]
 glasses_size = ["Adult XS (110-118 mm)", "Adult S (119-125 mm)", "Adult M (126-132 mm)", "Adult L (133-140 mm)", "Adult XL (141+ mm)", "Kid XS (90-106 mm)", "Kid S (107-112 mm)", "Kid M (113-118 mm)", "Kid L (119-150 mm)"]
 glasses_material = ["Titanium", "Flex Titanium", "Stainless Steel", "Other Metal", "Acetate", "Recycled Plastic", "Carbon Fiber", "Other Plastic"]
 glasses_rim = ["Full Rim", "Half Rim", "Rimless"]
 glasses_weight =["Ultra Light (<20 grams)", "Light (21-40 grams)", "Medium (41-60 grams)", "Heavy (61-80 grams)", "Extra Heavy (81-100 grams)"]
+face_shapes = ["Heart", "Oblong", "Oval", "Round", "Square"]
 glasses_features = ["Nose Pads", "Lightweight", "Spring Hinges", "Flexible", "Universal Fit", "Clip-Ons", "Engraving", "Protective"]
 model_images = [
     "https://static.zennioptical.com/production/products/general/32/17/3217321-modelimage.jpg?im=FaceCrop,algorithm=dnn",
@@ -94,182 +101,285 @@ product_images = [
 ]
 
 
-# Seed Products Collection
-def seed_products(count=10):
+# Each chunk gets its own generators seeded from (seed, kind, chunk index), so the
+# dataset is the same for a given seed no matter how many workers generate it
+def chunk_generators(seed, kind, chunk_index):
+    chunk_seed = seed * 1_000_003 + kind * 10_007 + chunk_index
+    rng = random.Random(chunk_seed)
+    faker = Faker()
+    faker.seed_instance(chunk_seed)
+    return rng, faker
+
+# ObjectId drawn from the chunk's generator, with the document's (naive UTC) date as its timestamp
+def seeded_id(rng, date):
+    return ObjectId(int(date.replace(tzinfo=timezone.utc).timestamp()).to_bytes(4, "big") + rng.randbytes(8))
+
+def chunk_ranges(count, batch_size):
+    return [(index, start, min(batch_size, count - start)) for index, start in enumerate(range(0, count, batch_size))]
+
+# Data shared with the worker processes (set by the pool initializer)
+worker_data = {}
+
+def init_worker(data):
+    worker_data.update(data)
+
+# Generate one chunk of products, reviews are embedded using the pre-generated user ids
+def generate_products(chunk):
+    chunk_index, start, count = chunk
+    rng, faker = chunk_generators(worker_data["seed"], 1, chunk_index)
+    user_ids = worker_data["user_ids"]
+    reference_date = worker_data["reference_date"]
     products = []
-    color = random.randint(1, 5)
-    
+
     for _ in range(count):
-        
+        color = rng.randint(1, 5)
+
         # Randomize the creation date
-        created_at = faker.date_time_between_dates(
-            datetime_start=datetime.now() - timedelta(days=5*365),
-            datetime_end=datetime.now()
-        )
-        
-        random_model_image = random.choice(model_images)
-        random_product_images = random.sample(product_images, random.randint(1, 4))
-        
+        created_at = reference_date - timedelta(seconds=rng.randint(0, 5 * 365 * 24 * 60 * 60))
+
+        random_model_image = rng.choice(model_images)
+        random_product_images = rng.sample(product_images, rng.randint(1, 4))
+
+        reviews = [
+            {
+                "user_id": rng.choice(user_ids),
+                "rating": rng.randint(1, 5),
+                "comment": faker.paragraph(nb_sentences=rng.randint(3, 6)),
+                "date": (created_at + timedelta(seconds=rng.randint(0, int((reference_date - created_at).total_seconds())))).isoformat()
+            }
+            for _ in range(rng.randint(1, 5))
+        ] if user_ids else []
+
+        average_rating = round(
+            sum(review["rating"] for review in reviews) / len(reviews), 1
+        ) if reviews else 0
+
         product = {
-            "name":  "Kacamata " + random.choice(glasses_shape) + " " + faker.word().capitalize(),
-            "shape": random.choice(glasses_shape),
-            "size": random.choice(glasses_size),
-            "material": random.sample(glasses_material, random.randint(1, 2)),
-            "rim": random.choice(glasses_rim),
-            "weight": random.choice(glasses_weight),
-            "features": random.sample(glasses_features, random.randint(1, 4)),
+            "_id": seeded_id(rng, created_at),
+            "name":  "Kacamata " + rng.choice(glasses_shape) + " " + faker.word().capitalize(),
+            "shape": rng.choice(glasses_shape),
+            "size": rng.choice(glasses_size),
+            "material": rng.sample(glasses_material, rng.randint(1, 2)),
+            "rim": rng.choice(glasses_rim),
+            "weight": rng.choice(glasses_weight),
+            "features": rng.sample(glasses_features, rng.randint(1, 4)),
+            "face_shape": rng.sample(face_shapes, rng.randint(1, 3)),
             "color_name": [faker.color_name() for _ in range(color)],
             "color": [faker.color() for _ in range(color)],
-            "frame_width": random.randint(130, 150),
-            "bridge": random.randint(19, 23),
-            "lens_width": random.randint(52, 55),
-            "lens_height": random.randint(46, 50),
-            "temple_length": random.randint(142, 150),
-            "price": random.randint(100000, 1000000),
-            "sold": random.randint(0, 10000),
-            "description": faker.paragraph(nb_sentences=random.randint(4,6)),
-            "stock": random.randint(10, 100),
+            "frame_width": rng.randint(130, 150),
+            "bridge": rng.randint(19, 23),
+            "lens_width": rng.randint(52, 55),
+            "lens_height": rng.randint(46, 50),
+            "temple_length": rng.randint(142, 150),
+            "price": rng.randint(100000, 1000000),
+            "sold": rng.randint(0, 10000),
+            "description": faker.paragraph(nb_sentences=rng.randint(4,6)),
+            "stock": rng.randint(10, 100),
             "images": [random_model_image] + random_product_images,
-            "reviews": [],
-            "rating": 0,
+            "reviews": reviews,
+            "rating": average_rating,
             "created_at": created_at
         }
 
         products.append(product)
-    
-    result = products_collection.insert_many(products)
-    print(f"{count} products inserted.")
-    return result.inserted_ids
 
-# Seed Users Collection
-def seed_users(count=10):
+    return products
+
+# Generate one chunk of users
+def generate_users(chunk):
+    chunk_index, start, count = chunk
+    rng, faker = chunk_generators(worker_data["seed"], 2, chunk_index)
+    user_ids = worker_data["user_ids"]
+    password = worker_data["password"]
     users = []
 
-    for _ in range(count):
-        # Generate a random number between 1 and 100
-        random_avatar_number = random.randint(1, 100)
+    for offset in range(count):
+        number = start + offset
+
+        # Construct the avatar URL with a random number between 1 and 100
+        avatar_url = f"https://avatar.iran.liara.run/public/{rng.randint(1, 100)}"
+
+        first_name = faker.first_name()
+        last_name = faker.last_name()
 
-        # Construct the avatar URL with the random number
-        avatar_url = f"https://avatar.iran.liara.run/public/{random_avatar_number}"
-        
         user = {
-            "name": faker.first_name() + " " + faker.last_name(),
-            "email": faker.email(),
-            "role": random.choice(["admin", "user"]),
-            "password": bcrypt.generate_password_hash("@Verystrongpassword123").decode('utf-8'),
-            "photo_profile": avatar_url,
-            "wishlist": [],
-            "cart": []
+            "_id": user_ids[number],
+            "name": first_name + " " + last_name,
+            # Numbered emails stay unique and predictable for load-test logins
+            "email": f"{first_name}.{last_name}.{number}@example.com".lower(),
+            "role": rng.choice(["admin", "user"]),
+            "password": password,
+            "photo_profile": avatar_url
         }
 
         users.append(user)
-    
-    result = users_collection.insert_many(users)
-    print(f"{count} users inserted.")
-    return result.inserted_ids
 
-# Seed Transactions Collection
-def seed_transactions(user_ids, product_ids, count=10):
+    return users
+
+# Generate the cart items of one chunk of users from in-memory product data
+def generate_carts(chunk):
+    chunk_index, start, count = chunk
+    rng, _ = chunk_generators(worker_data["seed"], 4, chunk_index)
+    user_ids = worker_data["user_ids"]
+    catalog = worker_data["catalog"]
+    carts = {}
+
+    for number in range(start, start + count):
+        for _ in range(rng.randint(1, 5)):
+            product_id, colors, _ = rng.choice(catalog)
+            if not colors:
+                continue
+
+            # One item per (user, product, color), like the unique index
+            key = (user_ids[number], product_id, rng.choice(colors))
+            carts.setdefault(key, {
+                "_id": seeded_id(rng, worker_data["reference_date"]),
+                "user_id": key[0],
+                "product_id": key[1],
+                "color": key[2],
+                "quantity": rng.randint(1, 2)
+            })
+
+    return list(carts.values())
+
+# Generate the wishlists of one chunk of users from in-memory product data
+def generate_wishlists(chunk):
+    chunk_index, start, count = chunk
+    rng, _ = chunk_generators(worker_data["seed"], 5, chunk_index)
+    user_ids = worker_data["user_ids"]
+    catalog = worker_data["catalog"]
+    wishlists = []
+
+    for number in range(start, start + count):
+        # dict keeps the draw order (set order of ObjectIds changes between runs)
+        product_ids = dict.fromkeys(rng.choice(catalog)[0] for _ in range(rng.randint(1, 9)))
+        wishlists.extend(
+            {"_id": seeded_id(rng, worker_data["reference_date"]), "user_id": user_ids[number], "product_id": product_id}
+            for product_id in product_ids
+        )
+
+    return wishlists
+
+# Generate one chunk of transactions using the products' real prices
+def generate_transactions(chunk):
+    chunk_index, start, count = chunk
+    rng, _ = chunk_generators(worker_data["seed"], 3, chunk_index)
+    user_ids = worker_data["user_ids"]
+    catalog = worker_data["catalog"]
+    reference_date = worker_data["reference_date"]
     transactions = []
 
     for _ in range(count):
-        user_id = random.choice(user_ids)
-
-        items = [
-            {
-                "product_id": random.choice(product_ids),
-                "quantity": random.randint(1, 5),
-                "price": random.randint(100000, 500000)
-            }
-            for _ in range(random.randint(1, 4))
-        ]
+        items = []
+        for _ in range(rng.randint(1, 4)):
+            product_id, _, price = rng.choice(catalog)
+            items.append({
+                "product_id": product_id,
+                "quantity": rng.randint(1, 5),
+                "price": price
+            })
 
+        # Native dates within the two years before the reference date, like the checkout writes
+        date = reference_date - timedelta(seconds=rng.randint(0, 2 * 365 * 24 * 60 * 60))
         transaction = {
-            "user_id": user_id,
+            "_id": seeded_id(rng, date),
+            "user_id": rng.choice(user_ids),
             "items": items,
             "total_amount": sum(item["quantity"] * item["price"] for item in items),
-            "date": faker.iso8601()
+            "date": date
         }
-        
+
         transactions.append(transaction)
-    
-    transactions_collection.insert_many(transactions)
-    print(f"{count} transactions inserted.")
 
-# Update Users Collection with Cart
-def update_cart_for_users(user_ids, product_ids):
-    for user_id in user_ids:
-        cart = []
+    return transactions
 
-        for _ in range(random.randint(1, 5)):
-            product_id = random.choice(product_ids)
-            product = products_collection.find_one({"_id": ObjectId(product_id)})
+# Generate chunks in worker processes and insert them as they arrive
+def seed_collection(collection, generate, count, data, workers, batch_size):
+    inserted = 0
+    started = time.time()
 
-            if not product or "color" not in product or not product["color"]:
-                continue
+    generated = 0
+    chunks = chunk_ranges(count, batch_size)
 
-            color = random.choice(product["color"])
-            quantity = random.randint(1, 2)
+    with Pool(workers, initializer=init_worker, initargs=(data,)) as pool:
+        # A chunk covers `count` source items (e.g. users for carts), not always as many documents
+        for (_, _, chunk_count), documents in zip(chunks, pool.imap(generate, chunks)):
+            if documents:
+                collection.insert_many(documents, ordered=False, bypass_document_validation=True)
+            inserted += len(documents)
+            generated += chunk_count
 
-            cart.append({
-                "product_id": product_id,
-                "color": color,
-                "quantity": quantity
-            })
+            yield documents
 
-        users_collection.update_one(
-            {"_id": user_id},
-            {"$set": {"cart": cart}}
-        )
+            print(f"{collection.name}: {generated}/{count} generated, {inserted} inserted ({inserted / (time.time() - started):.0f}/s)", end="\r")
 
-    print("Cart updated for users.")
+    print()
 
-# Update Users Collection with Wishlist
-def update_wishlist_for_users(user_ids, product_ids):
-    for user_id in user_ids:
-        wishlist = [
-            {
-                "product_id": random.choice(product_ids)
-            }
-            for _ in range(random.randint(1, 9))
-        ]
+# Seed Products Collection
+def seed_products(count, data, workers, batch_size):
+    # Only the fields needed later (cart colors, transaction prices) are kept in memory
+    catalog = []
 
-        users_collection.update_one(
-            {"_id": user_id},
-            {"$set": {"wishlist": wishlist}}
-        )
+    for documents in seed_collection(products_collection, generate_products, count, data, workers, batch_size):
+        catalog.extend((product["_id"], product["color"], product["price"]) for product in documents)
 
-    print("Wishlist updated for users.")
+    print(f"{count} products inserted.")
+    return catalog
 
-# Add Reviews to Products
-def add_reviews_to_products(user_ids, product_ids):
-    for product_id in product_ids:
-        reviews = [
-            {
-                "user_id": random.choice(user_ids),
-                "rating": random.randint(1, 5),
-                "comment": faker.paragraph(nb_sentences=random.randint(3, 6)),
-                "date": faker.iso8601()
-            }
-            for _ in range(random.randint(1, 5))
-        ]
+# Seed Users Collection
+def seed_users(count, data, workers, batch_size):
+    for _ in seed_collection(users_collection, generate_users, count, data, workers, batch_size):
+        pass
 
-        average_rating = round(
-            sum(review["rating"] for review in reviews) / len(reviews), 1
-        )
+    print(f"{count} users inserted.")
 
-        products_collection.update_one(
-            {"_id": product_id},
-            {"$set": {"reviews": reviews, "rating": average_rating}}
-        )
+# Seed Carts and Wishlists Collections (items for every user)
+def seed_carts_and_wishlists(count, data, workers, batch_size):
+    carts = sum(len(documents) for documents in seed_collection(carts_collection, generate_carts, count, data, workers, batch_size))
+    wishlists = sum(len(documents) for documents in seed_collection(wishlists_collection, generate_wishlists, count, data, workers, batch_size))
 
-    print("Reviews and ratings added to products.")
+    print(f"{carts} cart items and {wishlists} wishlist items inserted.")
+
+# Seed Transactions Collection
+def seed_transactions(count, data, workers, batch_size):
+    for _ in seed_collection(transactions_collection, generate_transactions, count, data, workers, batch_size):
+        pass
+
+    print(f"{count} transactions inserted.")
 
 # Main Seeding Function
 if __name__ == "__main__":
-    product_ids = seed_products(2000)                     # Step 1: Seed Products
-    user_ids = seed_users(120)                            # Step 2: Seed Users
-    seed_transactions(user_ids, product_ids, 5)         # Step 3: Seed Transactions
-    update_cart_for_users(user_ids, product_ids)        # Step 4: Update Cart
-    update_wishlist_for_users(user_ids, product_ids)    # Step 5: Update Wishlist
-    add_reviews_to_products(user_ids, product_ids)      # Step 6: Add Reviews
+    parser = argparse.ArgumentParser(description="Seed the database with generated glasses, users and transactions")
+    parser.add_argument("--products", type=int, default=2000, help="Number of products")
+    parser.add_argument("--users", type=int, default=120, help="Number of users")
+    parser.add_argument("--transactions", type=int, default=5, help="Number of transactions")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed generates the same data")
+    parser.add_argument("--reference-date", type=datetime.fromisoformat, default=datetime(2025, 1, 1),
+                        help="Generated dates (UTC) lie before this date, YYYY-MM-DD")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents generated and inserted per chunk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generator processes")
+    args = parser.parse_args()
+
+    # bcrypt is slow on purpose, every seeded user shares one precomputed hash
+    password = bcrypt.generate_password_hash(DEFAULT_PASSWORD).decode('utf-8')
+
+    # Ids are generated up front so products can embed reviews by users that are inserted later
+    rng, _ = chunk_generators(args.seed, 0, 0)
+    user_ids = [seeded_id(rng, args.reference_date) for _ in range(args.users)]
+    data = {
+        "seed": args.seed,
+        "user_ids": user_ids,
+        "password": password,
+        "reference_date": args.reference_date
+    }
+
+    # The transactions collection may have to be created as a time-series collection first
+    ensure_collections()
+
+    catalog = seed_products(args.products, data, args.workers, args.batch_size)    # Step 1: Seed Products (with reviews)
+
+    data["catalog"] = catalog
+    seed_users(args.users, data, args.workers, args.batch_size)                   # Step 2: Seed Users
+    if user_ids and catalog:
+        seed_carts_and_wishlists(args.users, data, args.workers, args.batch_size) # Step 3: Seed Carts and Wishlists
+        seed_transactions(args.transactions, data, args.workers, args.batch_size) # Step 4: Seed Transactions
@@ -0,0 +1,285 @@
+from flask import request
+from pymongo import MongoClient, ReplaceOne
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from . import http_cache, jobs
+import numpy as np
+import os
+import sys
+import math
+import hashlib
+import datetime
+import warnings
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+# Precomputed neighbors: {_id: product id, neighbors: [product ids], scores: [...], updated_at}
+similar_products = db["similar_products"]
+
+# Neighbors precomputed for every product
+SIMILAR_NEIGHBORS = int(os.getenv("SIMILAR_NEIGHBORS", 20))
+# Size of the similarity block computed at once (rows x catalog size)
+SIMILAR_BATCH_ELEMENTS = int(os.getenv("SIMILAR_BATCH_ELEMENTS", 16_000_000))
+
+# One-hot encoded attributes, and multi-valued ones (each field weighs as much as a single value)
+CATEGORY_FIELDS = ("shape", "rim", "size", "weight")
+SET_FIELDS = ("material", "features")
+# Standardized numeric attributes, price on a log scale
+NUMBER_FIELDS = ("price", "frame_width", "bridge", "lens_width", "lens_height", "temple_length")
+# Weight of each numeric attribute relative to a categorical one
+NUMBER_WEIGHT = 0.5
+
+# Encoded attributes of every product
+projection = {field: 1 for field in CATEGORY_FIELDS + SET_FIELDS + NUMBER_FIELDS}
+
+# Listing document returned for each neighbor
+LISTING_PROJECTION = {
+    "_id": 1,
+    "name": 1,
+    "price": 1,
+    "sold": 1,
+    "review_count": {"$size": "$reviews"},
+    "rating": 1,
+    "images": {"$slice": [{"$ifNull": ["$images", []]}, 1]}
+}
+
+def _values(value):
+    if value is None:
+        return []
+    return [str(item).lower() for item in value] if isinstance(value, list) else [str(value).lower()]
+
+def _numbers(product):
+    numbers = []
+
+    for field in NUMBER_FIELDS:
+        value = product.get(field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            numbers.append(np.nan)
+        elif field == "price":
+            numbers.append(math.log1p(max(value, 0)))
+        else:
+            numbers.append(float(value))
+
+    return numbers
+
+# Fingerprint of the attributes the encoding reads, stored with the neighbors so writes that don't
+# touch them (stock, sold, rating, ...) don't queue a refresh
+def _signature(product):
+    values = [sorted(set(_values(product.get(field)))) for field in CATEGORY_FIELDS + SET_FIELDS]
+    return hashlib.sha1(repr((values, _numbers(product))).encode()).hexdigest()[:16]
+
+# Feature matrix with one unit-length row per product (dot product = cosine similarity) and the
+# nearest neighbors of each row, either computed or loaded from similar_products
+class SimilarityIndex:
+    def __init__(self, products_list):
+        self.columns = {}
+        for product in products_list:
+            for field in CATEGORY_FIELDS + SET_FIELDS:
+                for value in _values(product.get(field)):
+                    self.columns.setdefault((field, value), len(self.columns))
+
+        # Missing numeric values sit at the mean
+        numbers = np.array([_numbers(product) for product in products_list], dtype=float).reshape(-1, len(NUMBER_FIELDS))
+        with warnings.catch_warnings():
+            # Attributes no product has yet are all NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.mean = np.nan_to_num(np.nanmean(numbers, axis=0)) if len(numbers) else np.zeros(len(NUMBER_FIELDS))
+            self.std = np.nan_to_num(np.nanstd(numbers, axis=0)) if len(numbers) else np.ones(len(NUMBER_FIELDS))
+        self.std[self.std == 0] = 1
+
+        self.size = len(products_list)
+        self.ids = [product["_id"] for product in products_list]
+        self.signatures = [_signature(product) for product in products_list]
+        self.rows = {product_id: row for row, product_id in enumerate(self.ids)}
+        self.matrix = np.zeros((self.size, len(self.columns) + len(NUMBER_FIELDS)), dtype=np.float32)
+        self.computed = np.zeros(self.size, dtype=bool)
+        self.neighbors = np.full((self.size, SIMILAR_NEIGHBORS), -1, dtype=np.int32)
+        self.scores = np.full((self.size, SIMILAR_NEIGHBORS), -np.inf, dtype=np.float32)
+
+        for row, product in enumerate(products_list):
+            self.matrix[row] = self.vector(product)
+
+    # Encoded row for a product
+    def vector(self, product):
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+
+        for field in CATEGORY_FIELDS + SET_FIELDS:
+            values = set(_values(product.get(field)))
+            for value in values:
+                vector[self.columns[(field, value)]] = 1 / math.sqrt(len(values))
+
+        numbers = (np.array(_numbers(product)) - self.mean) / self.std
+        vector[len(self.columns):] = np.clip(np.nan_to_num(numbers), -3, 3) / 3 * NUMBER_WEIGHT
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # Rows computed per batch so the score block stays around SIMILAR_BATCH_ELEMENTS
+    def batch_rows(self):
+        return max(1, SIMILAR_BATCH_ELEMENTS // max(self.size, 1))
+
+    # Top-k neighbors of the given rows, one matrix product per batch
+    def compute(self, rows):
+        count = min(SIMILAR_NEIGHBORS, self.size)
+        step = self.batch_rows()
+
+        for start in range(0, len(rows), step):
+            batch = rows[start:start + step]
+            scores = self.matrix[batch] @ self.matrix.T
+            scores[np.arange(len(batch)), batch] = -np.inf
+
+            top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            top[np.isneginf(top_scores)] = -1
+
+            self.neighbors[batch] = -1
+            self.scores[batch] = -np.inf
+            self.neighbors[batch, :count] = top
+            self.scores[batch, :count] = top_scores
+            self.computed[batch] = True
+
+    # Take a stored neighbor list; False when it points at a product that no longer exists
+    def load(self, document):
+        row = self.rows.get(document["_id"])
+        if row is None:
+            return True
+
+        neighbors = [self.rows.get(neighbor) for neighbor in document["neighbors"][:SIMILAR_NEIGHBORS]]
+        if None in neighbors:
+            return False
+
+        self.neighbors[row, :len(neighbors)] = neighbors
+        self.scores[row, :len(neighbors)] = document["scores"][:SIMILAR_NEIGHBORS]
+        self.computed[row] = True
+        return True
+
+    # Rows whose neighbors change when the changed rows did: their own, and every stored row the
+    # changed ones enter (beat its last neighbor) or may leave (already listed)
+    def affected(self, changed):
+        scores = self.matrix @ self.matrix[changed].T
+        scores[changed, np.arange(len(changed))] = -np.inf
+
+        affected = (scores > self.scores[:, -1:]).any(axis=1) | np.isin(self.neighbors, changed).any(axis=1)
+        affected &= self.computed
+        affected[changed] = True
+        return np.flatnonzero(affected)
+
+    def document(self, row, now):
+        count = int((self.neighbors[row] >= 0).sum())
+        return {
+            "_id": self.ids[row],
+            "neighbors": [self.ids[neighbor] for neighbor in self.neighbors[row, :count]],
+            "scores": [round(float(score), 6) for score in self.scores[row, :count]],
+            "signature": self.signatures[row],
+            "updated_at": now
+        }
+
+# Write the neighbors of the given rows to similar_products
+def _store(index, rows):
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    for start in range(0, len(rows), 1000):
+        similar_products.bulk_write([
+            ReplaceOne({"_id": index.ids[row]}, index.document(row, now), upsert=True)
+            for row in rows[start:start + 1000]
+        ], ordered=False)
+
+# Recompute the neighbors of every product batch by batch and replace similar_products with them,
+# e.g.: python -m app.similar build. Also the build_similar job after bulk catalog changes.
+def build():
+    started = datetime.datetime.now(datetime.timezone.utc)
+    index = SimilarityIndex(list(products.find({}, projection)))
+
+    step = index.batch_rows()
+    for start in range(0, index.size, step):
+        rows = np.arange(start, min(start + step, index.size))
+        index.compute(rows)
+        _store(index, rows)
+
+    # Deleted products
+    similar_products.delete_many({"updated_at": {"$lt": started}})
+    return index.size
+
+# refresh_similar job: recompute the neighbor lists the changed (or deleted) products affect. Vectors
+# come from the current catalog, neighbor lists from similar_products; new attribute values just add
+# columns, so the stored scores stay comparable apart from the standardization drift a build resets.
+def refresh(product_ids):
+    index = SimilarityIndex(list(products.find({}, projection)))
+
+    stale = []
+    for document in similar_products.find({}):
+        if not index.load(document):
+            stale.append(index.rows[document["_id"]])
+
+    changed = np.array([index.rows[product_id] for product_id in product_ids if product_id in index.rows], dtype=np.int64)
+    rows = np.union1d(index.affected(changed) if changed.size else [], stale).astype(np.int64)
+
+    if rows.size:
+        index.compute(rows)
+        _store(index, rows)
+
+    removed = [product_id for product_id in product_ids if product_id not in index.rows]
+    if removed:
+        similar_products.delete_many({"_id": {"$in": removed}})
+
+# Products were written (catalog_events calls this); documents are the changed products re-read with
+# (at least) this module's projection, deleted ones are missing. Queues a neighbor refresh for the
+# products whose encoded attributes differ from the ones their stored neighbors were computed from
+def apply_changes(product_ids, documents):
+    signatures = {product["_id"]: _signature(product) for product in documents}
+    stored = {
+        document["_id"]: document.get("signature")
+        for document in similar_products.find({"_id": {"$in": list(product_ids)}}, {"signature": 1})
+    }
+
+    changed = [product_id for product_id in product_ids if signatures.get(product_id) != stored.get(product_id)]
+    if changed:
+        jobs.enqueue("refresh_similar", product_ids=changed)
+
+# Many products changed at once: queue a full build
+def invalidate():
+    jobs.enqueue("build_similar")
+
+# Validators for a product's similar list: its stored neighbors and the listings (catalog version)
+def validators(id):
+    try:
+        document = similar_products.find_one({"_id": ObjectId(id)}, {"updated_at": 1})
+    except InvalidId:
+        return None
+
+    if not document:
+        return None
+
+    version, updated_at = http_cache.catalog_version()
+    query = hashlib.sha1(request.query_string).hexdigest()[:16]
+    return f"similar-{id}-{version}-{document['updated_at'].timestamp()}-{query}", max(filter(None, (updated_at, document["updated_at"])))
+
+# Most similar products: the stored neighbor list and their listing documents. An empty list for
+# products not built yet, None when the product doesn't exist
+def similar(product_id, limit=10):
+    try:
+        product_id = ObjectId(product_id)
+    except InvalidId:
+        return None
+
+    document = similar_products.find_one({"_id": product_id}, {"neighbors": {"$slice": limit}})
+    if document is None:
+        return [] if products.find_one({"_id": product_id}, {"_id": 1}) else None
+
+    listings = {product["_id"]: product for product in products.find({"_id": {"$in": document["neighbors"]}}, LISTING_PROJECTION)}
+    return [listings[neighbor] for neighbor in document["neighbors"] if neighbor in listings]
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["build"]:
+        print(f"Stored the neighbors of {build()} products")
+    else:
+        print("Usage: python -m app.similar build")
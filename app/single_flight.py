@@ -0,0 +1,71 @@
+from flask import request, make_response, current_app
+from functools import wraps
+from dotenv import load_dotenv
+from . import metrics
+import os
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Let concurrent identical reads in a worker process share one handler run
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+# How long a follower waits for the leader before running the handler itself
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", 10))
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        # (body, status, headers) of the leader's response, None if it failed
+        self.response = None
+
+_lock = threading.Lock()
+# key -> _Call currently running it
+_calls = {}
+
+# Route, URL parameters and query string (in any order), plus the conditional headers the response
+# depends on (a 304 is only shared with requests that sent the same validators)
+def _key():
+    return (
+        request.url_rule.rule,
+        tuple(sorted(request.view_args.items())),
+        tuple(sorted(request.args.items(multi=True))),
+        request.headers.get("If-None-Match"),
+        request.headers.get("If-Modified-Since")
+    )
+
+# Coalesce concurrent identical GETs: the first request (leader) runs the handler, the ones arriving
+# while it runs (followers) wait and get a copy of its response. Goes above http_cache.conditional, so
+# only the leader reads the validators and followers don't touch Mongo at all.
+def coalesce(fn):
+    @wraps(fn)
+    def decorated_function(*args, **kwargs):
+        if not SINGLE_FLIGHT:
+            return fn(*args, **kwargs)
+
+        key = _key()
+        with _lock:
+            call = _calls.get(key)
+            leader = call is None
+            if leader:
+                call = _calls[key] = _Call()
+
+        metrics.observe_single_flight(request.url_rule.rule, "leader" if leader else "follower")
+
+        if leader:
+            try:
+                response = make_response(fn(*args, **kwargs))
+                call.response = (response.get_data(), response.status_code, list(response.headers))
+            finally:
+                with _lock:
+                    del _calls[key]
+                call.done.set()
+
+        # The leader failed or is stuck, run the handler for this request
+        elif not call.done.wait(SINGLE_FLIGHT_WAIT_SECONDS) or call.response is None:
+            return fn(*args, **kwargs)
+
+        # Responses are mutable (headers, compression), every request gets its own
+        body, status, headers = call.response
+        return current_app.response_class(body, status=status, headers=headers)
+    return decorated_function
@@ -0,0 +1,40 @@
+from flask import request
+
+# Narrow an endpoint's projection to the fields asked for with ?fields=name,price,...
+# Inclusion projections only keep requested fields they already return; exclusion
+# projections (e.g. {"password": 0}) become an inclusion of the requested fields minus the excluded ones.
+def sparse_projection(projection=None):
+    fields = request.args.get("fields")
+    if not fields:
+        return projection
+
+    # Operators and empty names can't be used as field paths
+    requested = {field.strip() for field in fields.split(",") if field.strip() and not field.strip().startswith("$")}
+    projection = projection or {}
+
+    included = {field: value for field, value in projection.items() if value != 0}
+    if included:
+        sparse = {field: value for field, value in included.items() if field in requested}
+    else:
+        excluded = {field for field, value in projection.items() if value == 0}
+        sparse = {
+            field: 1 for field in requested
+            if field not in excluded and field.split(".")[0] not in excluded
+        }
+
+    # The id is always returned
+    sparse["_id"] = included.get("_id", 1)
+    return sparse
+
+# Apply a projection from sparse_projection to a document that doesn't come from Mongo
+# (e.g. an archived transaction); only top-level fields are considered
+def apply_projection(document, projection):
+    if not projection:
+        return document
+
+    included = {field.split(".")[0] for field, value in projection.items() if value != 0 and field != "_id"}
+    if included:
+        return {field: value for field, value in document.items() if field in included or (field == "_id" and projection.get("_id", 1))}
+
+    excluded = {field for field, value in projection.items() if value == 0}
+    return {field: value for field, value in document.items() if field not in excluded}
@@ -0,0 +1,219 @@
+from flask import request
+from pymongo import MongoClient
+from bisect import bisect_left
+from dotenv import load_dotenv
+import numpy as np
+import os
+import re
+import time
+import hashlib
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize MongoDB client
+client = MongoClient(os.getenv("MONGO_URI"))
+db = client[os.getenv("MONGO_DB_NAME")]
+products = db["products"]
+
+# Full rebuild interval, picks up writes made by other worker processes
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", 300))
+
+# Fields kept in memory for each product
+projection = {
+    "_id": 1,
+    "name": 1,
+    "shape": 1,
+    "sold": 1
+}
+
+# Sorted list of (term, product_id), one term per word start of the name ("gold aviator",
+# "aviator") so a prefix matches a contiguous slice; _weights holds each term's product sold count
+_terms = []
+_weights = np.zeros(0)
+# product_id -> (terms, name, shapes, weight)
+_entries = {}
+# shape -> [product count, total sold of its products]
+_shapes = {}
+_lock = threading.Lock()
+_built_at = None
+# What this worker's index reflects: a random id per rebuild and a counter of applied changes
+_generation = (None, 0)
+
+def _weight(product):
+    sold = product.get("sold")
+    return float(sold) if isinstance(sold, (int, float)) else 0.0
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _name_terms(name):
+    words = re.findall(r"\w+", str(name or "").lower())
+    return [" ".join(words[index:]) for index in range(len(words))]
+
+def _entry(product):
+    name = product.get("name") or ""
+    shapes = tuple(dict.fromkeys(shape for shape in _as_list(product.get("shape")) if shape))
+    return (_name_terms(name), name, shapes, _weight(product))
+
+# Must be called with _lock held
+def _add_shapes(shapes, count, weight):
+    for shape in shapes:
+        totals = _shapes.setdefault(shape, [0, 0.0])
+        totals[0] += count
+        totals[1] += weight
+        if not totals[0]:
+            del _shapes[shape]
+
+# Rebuild the whole index from Mongo
+def rebuild():
+    global _terms, _weights, _entries, _shapes, _built_at, _generation
+
+    # Build the new index outside the lock, readers keep using the old one meanwhile
+    entries = {}
+    for product in products.find({}, projection):
+        entries[str(product["_id"])] = _entry(product)
+
+    pairs = sorted((term, product_id) for product_id, entry in entries.items() for term in set(entry[0]))
+    weights = np.array([entries[product_id][3] for _, product_id in pairs], dtype=float)
+
+    shapes = {}
+    for _, _, product_shapes, weight in entries.values():
+        for shape in product_shapes:
+            totals = shapes.setdefault(shape, [0, 0.0])
+            totals[0] += 1
+            totals[1] += weight
+
+    with _lock:
+        _terms = pairs
+        _weights = weights
+        _entries = entries
+        _shapes = shapes
+        _built_at = time.monotonic()
+        _generation = (os.urandom(6).hex(), 0)
+
+# Drop the index, it is rebuilt on next use
+def invalidate():
+    global _built_at
+
+    _built_at = None
+
+# Must be called with _lock held
+def _remove(product_id):
+    global _weights
+
+    entry = _entries.pop(product_id, None)
+    if not entry:
+        return
+
+    _add_shapes(entry[2], -1, -entry[3])
+
+    for term in set(entry[0]):
+        index = bisect_left(_terms, (term, product_id))
+        if index < len(_terms) and _terms[index] == (term, product_id):
+            _terms.pop(index)
+            _weights = np.delete(_weights, index)
+
+# Must be called with _lock held
+def _insert(product_id, entry):
+    global _weights
+
+    _entries[product_id] = entry
+    _add_shapes(entry[2], 1, entry[3])
+
+    for term in set(entry[0]):
+        index = bisect_left(_terms, (term, product_id))
+        _terms.insert(index, (term, product_id))
+        _weights = np.insert(_weights, index, entry[3])
+
+# Update changed products; documents are the changed products re-read with (at least) this
+# module's projection, deleted ones are missing
+def apply_changes(product_ids, documents):
+    global _generation
+
+    if _built_at is None:
+        return
+
+    found = {str(product["_id"]): product for product in documents}
+
+    with _lock:
+        _generation = (_generation[0], _generation[1] + 1)
+
+        for product_id in map(str, product_ids):
+            old = _entries.get(product_id)
+            product = found.get(product_id)
+            entry = _entry(product) if product else None
+
+            # Most writes (checkouts, reviews) only change sold, the terms stay in place
+            if old and entry and old[0] == entry[0] and old[2] == entry[2]:
+                _entries[product_id] = entry
+                for shape in entry[2]:
+                    _shapes[shape][1] += entry[3] - old[3]
+                for term in set(entry[0]):
+                    _weights[bisect_left(_terms, (term, product_id))] = entry[3]
+                continue
+
+            _remove(product_id)
+            if entry:
+                _insert(product_id, entry)
+
+def _ensure_built():
+    if _built_at is None or time.monotonic() - _built_at > SUGGEST_REFRESH_SECONDS:
+        rebuild()
+
+# Validators for /product/suggest from this worker's index generation, no Mongo query per keystroke.
+# No Last-Modified: the generation isn't a point in time
+def validators(*args, **kwargs):
+    _ensure_built()
+
+    build, changes = _generation
+    query = hashlib.sha1(request.query_string).hexdigest()[:16]
+    return f"suggest-{build}-{changes}-{query}", None
+
+# Best selling products whose name has a word starting with the prefix, and matching shapes
+def suggest(prefix, limit=10):
+    _ensure_built()
+
+    prefix = " ".join(re.findall(r"\w+", prefix.lower()))
+    if not prefix:
+        return [], []
+
+    with _lock:
+        start = bisect_left(_terms, (prefix,))
+        end = bisect_left(_terms, (prefix + "\uffff",), start)
+        weights = _weights[start:end]
+
+        # A product can match through several words, take extra candidates (more each round) until
+        # the limit is filled or every match was seen
+        count = limit * 3
+        while True:
+            count = min(len(weights), count)
+            candidates = np.argpartition(-weights, count - 1)[:count] if count < len(weights) else np.arange(len(weights))
+            candidates = candidates[np.argsort(-weights[candidates], kind="stable")]
+
+            names = []
+            seen = set()
+            for index in candidates:
+                product_id = _terms[start + index][1]
+                if product_id in seen:
+                    continue
+
+                seen.add(product_id)
+                names.append({"_id": product_id, "name": _entries[product_id][1], "sold": int(weights[index])})
+                if len(names) == limit:
+                    break
+
+            if len(names) == limit or count == len(weights):
+                break
+            count *= 2
+
+        # Shapes are few, rank them by the total sold of their products
+        shapes = sorted(
+            (shape for shape in _shapes if str(shape).lower().startswith(prefix)),
+            key=lambda shape: -_shapes[shape][1]
+        )[:limit]
+
+    return names, shapes
@@ -1,11 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, UpdateOne, errors
 from bson.objectid import ObjectId
 from functools import wraps
 from dotenv import load_dotenv
+from . import http_cache, archive, catalog_events, jobs, unit_of_work
+from .sparse_fields import sparse_projection, apply_projection
 import os
 import datetime
+import itertools
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,6 +19,7 @@ db = client[os.getenv("MONGO_DB_NAME")]
 users = db["users"]
 products = db["products"]
 transactions = db["transactions"]
+carts = db["carts"]
 
 # Create a Blueprint for transactions
 transactions_bp = Blueprint('transactions', __name__)
@@ -27,7 +31,7 @@ def role_required(role):
         @jwt_required()
         def decorated_function(*args, **kwargs):
             current_user = get_jwt_identity()
-            user = users.find_one({"_id": ObjectId(current_user)})
+            user = users.find_one({"_id": ObjectId(current_user)}, {"role": 1})
             
             if not user:
                 return jsonify({"error": "User not found"}), 404
@@ -39,15 +43,111 @@ def role_required(role):
         return decorated_function
     return wrapper
 
-# Helper function to format transaction data
-def format_transaction(transaction):
-    transaction["_id"] = str(transaction["_id"])
-    transaction["user_id"] = str(transaction["user_id"])
+# A product's stock ran out between the order's checks and its write
+class OutOfStock(Exception):
+    def __init__(self, product_id=None):
+        super().__init__(f"Product with ID {product_id} is out of stock." if product_id else "A product in the order is out of stock.")
+        self.product_id = product_id
 
-    for item in transaction.get('items', []):
-        item['product_id'] = str(item['product_id'])
+def stock_update(quantity):
+    return http_cache.with_product_changed({"$inc": {
+            "stock": -quantity,
+            "sold": quantity
+        }
+    })
 
-    return transaction
+# Validate an order and write it: stock updates, the transaction and (for a cart checkout) the cart
+# items it came from, as one unit of work (a single transaction with MONGO_TRANSACTIONS=true).
+# items are {"product_id": ObjectId, "quantity": int, ["color"]}
+def place_order(user_id, items, cart_item_ids=None):
+    # All products in one query, before changing any stock so a failing item leaves the others untouched
+    found = {product["_id"]: product for product in products.find({"_id": {"$in": list({item["product_id"] for item in items})}})}
+    order_products = [found.get(item["product_id"]) for item in items]
+    total_amount = 0
+    transaction_items = []
+
+    # The same product can be ordered in several colors
+    ordered = {}
+    for item in items:
+        ordered[item["product_id"]] = ordered.get(item["product_id"], 0) + item["quantity"]
+
+    for item, product in zip(items, order_products):
+        # Check product and calculate total price
+        if not product:
+            return jsonify({"error": f"Product with ID {item['product_id']} not found."}), 404
+        
+        if product["stock"] < ordered[item["product_id"]]:
+            return jsonify({"error": f"Not enough stock for product {item['product_id']}."}), 400
+        
+        item_price = product["price"]
+        total_item_price = item_price * item["quantity"]
+        total_amount += total_item_price
+
+        transaction_item = {
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            "price": item_price
+        }
+        if item.get("color"):
+            transaction_item["color"] = item["color"]
+        transaction_items.append(transaction_item)
+
+    date = datetime.datetime.now(datetime.timezone.utc)
+
+    # The stock read above can be outdated by the time of the write (concurrent checkouts), every
+    # decrement is guarded by the stock it needs and the order fails with 409 when one doesn't match
+    def guarded(item):
+        return {"_id": item["product_id"], "stock": {"$gte": item["quantity"]}}
+
+    def write(session):
+        if session is not None:
+            # One round trip for every stock/sold update, a shortfall aborts the transaction
+            result = products.bulk_write(
+                [UpdateOne(guarded(item), stock_update(item["quantity"])) for item in transaction_items],
+                ordered=False,
+                session=session
+            )
+            if result.matched_count < len(transaction_items):
+                raise OutOfStock()
+        else:
+            # Without a transaction the decrements already applied are undone by hand
+            applied = []
+            for item in transaction_items:
+                if not products.update_one(guarded(item), stock_update(item["quantity"])).matched_count:
+                    for done in applied:
+                        products.update_one({"_id": done["product_id"]}, stock_update(-done["quantity"]))
+                    raise OutOfStock(item["product_id"])
+                applied.append(item)
+
+        transaction_id = transactions.insert_one({
+            "user_id": ObjectId(user_id),
+            "items": transaction_items,
+            "total_amount": round(total_amount, 2),
+            "date": date
+        }, session=session).inserted_id
+
+        # Only the items the order was built from, anything added meanwhile stays in the cart
+        if cart_item_ids:
+            carts.delete_many({"_id": {"$in": cart_item_ids}}, session=session)
+
+        return transaction_id
+
+    try:
+        transaction_id = unit_of_work.run(client, write)
+    except OutOfStock as e:
+        return jsonify({"error": str(e)}), 409
+
+    # Keep the sales rollups current, off the request path
+    try:
+        jobs.enqueue("record_sales", transaction_id=transaction_id)
+    except errors.PyMongoError as e:
+        # The order is placed, the periodic recompute picks it up
+        print(f"Error queueing sales rollup update: {e}")
+
+    # Stock and sold counts changed, update the in-process indexes and invalidate cached pages
+    catalog_events.products_changed(list({item["product_id"] for item in transaction_items}))
+
+    return jsonify({"message": "Transaction created", "_id": str(transaction_id)}), 201
 
 # create new transaction
 @transactions_bp.route("/", methods=["POST"])
@@ -59,11 +159,9 @@ def create_transaction():
         return jsonify({"error": "'items' field must be provided as a list."}), 400
     
     user_id = get_jwt_identity()
-    items = data["items"]
-    total_amount = 0
-    transaction_items = []
+    items = []
 
-    for item in items:
+    for item in data["items"]:
         if not isinstance(item, dict) or "product_id" not in item or "quantity" not in item:
             return jsonify({"error": "Each item must contain 'product_id' and 'quantity'."}), 400
         
@@ -75,74 +173,152 @@ def create_transaction():
         if not isinstance(item["quantity"], int) or item["quantity"] <= 0:
             return jsonify({"error": "'quantity' must be a positive integer."}), 400
 
-        # Fetch product and calculate total price
-        product = products.find_one({"_id": product_id})
-        if not product:
-            return jsonify({"error": f"Product with ID {item['product_id']} not found."}), 404
-        
-        if product["stock"] < 1:
-            return jsonify({"error": "Product is out of stock"}), 400
-        
-        item_price = product["price"]
-        total_item_price = item_price * item["quantity"]
-        total_amount += total_item_price
+        items.append({"product_id": product_id, "quantity": item["quantity"]})
 
-        transaction_items.append({
-            "product_id": product_id,
-            "quantity": item["quantity"],
-            "price": item_price
-        })
-
-        products.update_one(
-            {"_id": ObjectId(product_id)},
-            {"$inc": {
-                    "stock": -item["quantity"],
-                    "sold": item["quantity"]
-                }
-            }
-        )
-
-    transaction_id = transactions.insert_one({
-        "user_id": ObjectId(user_id),
-        "items": transaction_items,
-        "total_amount": round(total_amount, 2),
-        "date": datetime.datetime.now().isoformat()
-    }).inserted_id
+    return place_order(user_id, items)
 
-    return jsonify({"message": "Transaction created", "_id": str(transaction_id)}), 201
+# Check out the current user's stored cart, the ordered items are removed from it. Only atomic with
+# MONGO_TRANSACTIONS=true: otherwise the stock updates, the transaction and the cart removal are
+# separate writes (a stock shortfall still undoes the stock updates and fails the order with 409)
+@transactions_bp.route("/from-cart", methods=["POST"])
+@jwt_required()
+def create_transaction_from_cart():
+    user_id = get_jwt_identity()
+
+    cart = list(carts.find({"user_id": ObjectId(user_id)}, {"product_id": 1, "color": 1, "quantity": 1}))
+    if not cart:
+        return jsonify({"error": "Cart is empty."}), 400
+
+    items = [{"product_id": item["product_id"], "quantity": item["quantity"], "color": item.get("color")} for item in cart]
 
-# Get all transactions
+    return place_order(user_id, items, [item["_id"] for item in cart])
+
+# Date range filter from ?from=&to= (ISO dates or datetimes, UTC unless an offset is given; a plain
+# date as 'to' includes that whole day); returns (query on date or None, error message)
+def date_range_query(args):
+    date_query = {}
+
+    try:
+        if args.get("from"):
+            date_query["$gte"] = datetime.datetime.fromisoformat(args["from"])
+        if args.get("to"):
+            to = datetime.datetime.fromisoformat(args["to"])
+            if len(args["to"]) == 10:
+                date_query["$lt"] = to + datetime.timedelta(days=1)
+            else:
+                date_query["$lte"] = to
+    except ValueError:
+        return None, "'from' and 'to' must be ISO dates (YYYY-MM-DD) or datetimes."
+
+    return date_query or None, None
+
+def include_archived():
+    return request.args.get("include_archived", "false").lower() == "true"
+
+# Get all transactions (optionally within ?from=&to=, with ?include_archived=true also the archived ones)
 @transactions_bp.route("/", methods=["GET"])
 @role_required("admin")
 def get_all_transactions():
-    transactions_list = [format_transaction(transaction) for transaction in transactions.find()]
-    return jsonify(transactions_list), 200
+    date_query, error = date_range_query(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Range queries use the date index
+    query = {"date": date_query} if date_query else {}
+    projection = sparse_projection()
+
+    if not include_archived():
+        transactions_list = list(transactions.find(query, projection))
+        return jsonify(transactions_list), 200
+
+    # Hot and archived transactions together can be large, stream them as one JSON array
+    def generate():
+        archived = (apply_projection(row, projection) for row in archive.iter_archived(date_query=date_query))
+        chunk = "["
+
+        for index, transaction in enumerate(itertools.chain(transactions.find(query, projection), archived)):
+            chunk += ("," if index else "") + current_app.json.dumps(transaction)
+
+            if len(chunk) > 64 * 1024:
+                yield chunk
+                chunk = ""
+
+        yield chunk + "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 # Get transaction by ID
 @transactions_bp.route("/<id>", methods=["GET"])
 @jwt_required()
 def get_transaction(id):
     try:
-        transaction = transactions.find_one({"_id": ObjectId(id)})
+        transaction = transactions.find_one({"_id": ObjectId(id)}, sparse_projection())
         if transaction:
-            return jsonify(format_transaction(transaction)), 200
+            return jsonify(transaction), 200
         else:
             return jsonify({"error": "transactions not found"}), 404
 
     except errors.InvalidId:
         return jsonify({"error": "Invalid ID format"}), 400
     
-# Get transaction by ID
+# Get the current user's transactions, newest first and paginated (?include_archived=true adds archived ones)
 @transactions_bp.route("/my_transactions", methods=["GET"])
-@role_required("admin")
+@jwt_required()
 def my_transaction():
     try:
-        user_id = get_jwt_identity()
-        my_transaction_list = [format_transaction(transaction) for transaction in transactions.find({"user_id": ObjectId(user_id)})]
-        if my_transaction_list:
-            return jsonify(my_transaction_list), 200
-        else:
-            return jsonify({"error": "transaction not found"}), 404
+        page = int(request.args.get("page", 1))  # Default to page 1 if not provided
+        limit = int(request.args.get("limit", 10))  # Default to 10 items per page if not provided
+    except ValueError:
+        return jsonify({"error": "'page' and 'limit' must be integers."}), 400
 
-    except errors.InvalidId:
-        return jsonify({"error": "Invalid ID format"}), 400
\ No newline at end of file
+    if page < 1 or not 1 <= limit <= 100:
+        return jsonify({"error": "'page' must be positive and 'limit' between 1 and 100."}), 400
+
+    date_query, error = date_range_query(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    user_id = ObjectId(get_jwt_identity())
+    query = {"user_id": user_id}
+    if date_query:
+        query["date"] = date_query
+
+    # Served by the (user_id, date) index, no in-memory sort, with or without a date range
+    projection = sparse_projection()
+    cursor = transactions.find(query, projection).sort("date", -1).skip((page - 1) * limit).limit(limit)
+    my_transaction_list = list(cursor)
+
+    # Check if there are more items to load
+    total_count = transactions.count_documents(query)
+
+    # Archived transactions are all older than the hot ones, they continue the list after them
+    archived_count, archived_total = archive.archived_totals(user_id, date_query) if include_archived() else (0, 0)
+    if archived_count and len(my_transaction_list) < limit:
+        start = max((page - 1) * limit - total_count, 0)
+        archived = archive.archived_page(user_id, date_query, start, limit - len(my_transaction_list))
+        my_transaction_list += [apply_projection(row, projection) for row in archived]
+    total_count += archived_count
+    has_more = (page * limit) < total_count
+    next_page = page + 1 if has_more else None
+    remaining_transactions = total_count - (page * limit) if has_more else 0
+
+    response = {
+        "transactions": my_transaction_list,
+        "has_more": has_more,
+        "next_page": next_page,
+        "remaining_transactions": remaining_transactions
+    }
+
+    # Optional totals, computed by Mongo over the whole history (or the requested range)
+    if request.args.get("summary", "false").lower() == "true":
+        summary = next(transactions.aggregate([
+            {"$match": query},
+            {"$group": {"_id": None, "total_spent": {"$sum": "$total_amount"}, "order_count": {"$sum": 1}}}
+        ]), None)
+
+        response["summary"] = {
+            "total_spent": (summary["total_spent"] if summary else 0) + archived_total,
+            "order_count": (summary["order_count"] if summary else 0) + archived_count
+        }
+
+    return jsonify(response), 200
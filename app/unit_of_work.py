@@ -0,0 +1,18 @@
+from dotenv import load_dotenv
+import os
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Run multi-step writes (checkout, batch cart updates) in one Mongo transaction (MONGO_TRANSACTIONS=true,
+# needs a replica set); otherwise the steps run one after another
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "false").lower() == "true"
+
+# Call write(session) inside a transaction on the client the written collections belong to,
+# write(None) when transactions are off; returns what write returns
+def run(client, write):
+    if not MONGO_TRANSACTIONS:
+        return write(None)
+
+    with client.start_session() as session:
+        return session.with_transaction(write)
@@ -5,6 +5,7 @@ from pymongo import MongoClient, errors
 from bson.objectid import ObjectId
 from functools import wraps
 from dotenv import load_dotenv
+from .sparse_fields import sparse_projection
 import os
 
 # Load environment variables from .env file
@@ -30,7 +31,7 @@ def role_required(role):
         @jwt_required()
         def decorated_function(*args, **kwargs):
             current_user = get_jwt_identity()
-            user = users.find_one({"_id": ObjectId(current_user)})
+            user = users.find_one({"_id": ObjectId(current_user)}, {"role": 1})
             
             if not user:
                 return jsonify({"error": "User not found"}), 404
@@ -42,24 +43,14 @@ def role_required(role):
         return decorated_function
     return wrapper
 
-# Helper function to format user data
-def format_user(user):
-    user["_id"] = str(user["_id"])
-    user.pop("password", None)
-
-    for product in user.get("wishlist", []):
-        product["product_id"] = str(product["product_id"])
-
-    for product in user.get("cart", []):
-        product["product_id"] = str(product["product_id"])
-
-    return user
+# Fields returned by the user endpoints (everything but the password hash)
+USER_PROJECTION = {"password": 0}
 
 # Get all users (only accessible to admin)
 @user_bp.route("/", methods=["GET"])
 @role_required("admin")
 def get_all_users():
-    users_list = [format_user(user) for user in users.find()]
+    users_list = list(users.find({}, sparse_projection(USER_PROJECTION)))
 
     return jsonify(users_list), 200
 
@@ -68,9 +59,9 @@ def get_all_users():
 @role_required("admin")
 def get_user(id):
     try:
-        user = users.find_one({"_id": ObjectId(id)})
+        user = users.find_one({"_id": ObjectId(id)}, sparse_projection(USER_PROJECTION))
         if user:
-            return jsonify(format_user(user)), 200
+            return jsonify(user), 200
         else:
             return jsonify({"error": "User not found"}), 404
 
@@ -0,0 +1,139 @@
+# Accuracy/latency comparison of the landmark backends (LANDMARK_BACKEND=dlib68 vs compact).
+#
+# For every fixture image the face is detected once, then each backend predicts landmarks and
+# a face shape with its own scaler/model. The report shows model size, load time, memory,
+# landmark latency, landmark error and face-shape agreement against dlib68 (and accuracy when
+# a labels CSV of "filename,face_shape" rows is given).
+#
+# Usage:
+#   python benchmarks/landmark_backend_report.py --images benchmarks/fixtures --labels faces.csv
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+# The app modules create (lazy) Mongo clients on import, no server is contacted here
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import dlib
+import joblib
+import numpy as np
+
+from app import model as face_model
+from predict_benchmark import IMAGE_EXTENSIONS, percentiles
+
+# Current resident memory in MB (Linux only)
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+def load_backend(name, predictor_path, scaler_path, model_path):
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+
+    backend = {
+        "name": name,
+        "landmarks": face_model.LANDMARK_BACKENDS[name](predictor_path),
+        "scaler": joblib.load(scaler_path),
+        "model": joblib.load(model_path),
+        "load_seconds": time.perf_counter() - start,
+        "predictor_mb": os.path.getsize(predictor_path) / (1024 * 1024)
+    }
+
+    rss_after = current_rss_mb()
+    backend["rss_mb"] = rss_after - rss_before if rss_before is not None else None
+    return backend
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare landmark backends")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "fixtures"))
+    parser.add_argument("--labels", help="CSV of filename,face_shape for accuracy")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed landmark runs per image")
+    parser.add_argument("--dlib68-predictor", default=face_model.Dlib68Landmarks.default_path)
+    parser.add_argument("--dlib68-scaler", default="models/scaler.pkl")
+    parser.add_argument("--dlib68-model", default="models/model.pkl")
+    parser.add_argument("--compact-predictor", default=face_model.CompactLandmarks.default_path)
+    parser.add_argument("--compact-scaler", default="models/compact/scaler.pkl")
+    parser.add_argument("--compact-model", default="models/compact/model.pkl")
+    args = parser.parse_args()
+
+    labels = {}
+    if args.labels:
+        with open(args.labels, newline="") as f:
+            labels = {os.path.basename(filename): face_shape for filename, face_shape in csv.reader(f)}
+
+    backends = [
+        load_backend("dlib68", args.dlib68_predictor, args.dlib68_scaler, args.dlib68_model),
+        load_backend("compact", args.compact_predictor, args.compact_scaler, args.compact_model)
+    ]
+    detector = dlib.get_frontal_face_detector()
+
+    results = {backend["name"]: {"landmark_times": [], "predictions": {}, "errors": []} for backend in backends}
+
+    for filename in sorted(os.listdir(args.images)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        img = cv2.imread(os.path.join(args.images, filename))
+        if img is None:
+            continue
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = detector(gray)
+        if len(faces) == 0:
+            continue
+
+        reference = None
+        for backend in backends:
+            result = results[backend["name"]]
+
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                landmarks = backend["landmarks"](gray, faces[0])
+                result["landmark_times"].append(time.perf_counter() - start)
+
+            features = face_model.extract_features_from_landmarks(landmarks)
+            prediction = backend["model"].predict(backend["scaler"].transform([features]))
+            result["predictions"][filename] = prediction.item() if isinstance(prediction, np.ndarray) else prediction
+
+            # Landmark error in pixels against the 68-point model, on the points the features use
+            if reference is None:
+                reference = landmarks
+            else:
+                points = face_model.FEATURE_LANDMARKS
+                result["errors"].append(float(np.linalg.norm(landmarks[points] - reference[points], axis=1).mean()))
+
+    baseline = results["dlib68"]["predictions"]
+    report = {}
+
+    for backend in backends:
+        result = results[backend["name"]]
+        predictions = result["predictions"]
+        labelled = [filename for filename in predictions if filename in labels]
+
+        report[backend["name"]] = {
+            "faces": len(predictions),
+            "predictor_mb": round(backend["predictor_mb"], 1),
+            "load_seconds": round(backend["load_seconds"], 3),
+            "rss_mb": round(backend["rss_mb"], 1) if backend["rss_mb"] is not None else None,
+            "landmark_ms": percentiles(result["landmark_times"]),
+            "mean_landmark_error_px": round(float(np.mean(result["errors"])), 2) if result["errors"] else None,
+            "agreement_with_dlib68": round(
+                sum(predictions[filename] == baseline.get(filename) for filename in predictions) / len(predictions), 3
+            ) if predictions else None,
+            "accuracy": round(
+                sum(predictions[filename] == labels[filename] for filename in labelled) / len(labelled), 3
+            ) if labelled else None
+        }
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
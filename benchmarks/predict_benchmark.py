@@ -0,0 +1,171 @@
+# Offline CPU benchmark for the /model/predict pipeline.
+#
+# Runs the app's own prediction path (app.model: save the upload to a temporary folder, read it
+# back, detect landmarks, predict) on a local folder of images and reports per-stage latency
+# percentiles, throughput for 1..N worker processes and peak RSS. The prediction cache is not used.
+#
+# Usage:
+#   python benchmarks/predict_benchmark.py --images benchmarks/fixtures --repeat 5 --workers 4 --output report.json
+from multiprocessing import Pool
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+# The app modules create (lazy) Mongo clients on import, no server is contacted here
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from werkzeug.datastructures import FileStorage
+
+from app import model as face_model
+
+# Stages timed by app.model's hooks: save and decode in read_uploaded_image, the rest in predict_face_shape
+STAGES = ["save", "decode", "grayscale", "detect", "landmark", "features", "scale", "predict", "predict_proba"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+def load_images(folder):
+    images = []
+
+    for filename in sorted(os.listdir(folder)):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(folder, filename), "rb") as f:
+                images.append((filename, f.read()))
+
+    return images
+
+# An upload like the one /model/predict receives
+def upload(filename, image_bytes):
+    return FileStorage(stream=io.BytesIO(image_bytes), filename=filename)
+
+# Run the app's pipeline on one image, returns ({stage: seconds}, whether a face shape was predicted);
+# stages after a miss are skipped. Throughput runs pass timings=None, like the app
+def run_pipeline(filename, image_bytes, timings=None):
+    img = face_model.read_uploaded_image(upload(filename, image_bytes), timings)
+    if img is None:
+        return timings, False
+
+    return timings, face_model.predict_face_shape(img, timings) is not None
+
+def percentiles(values):
+    if not values:
+        return None
+
+    values = np.array(values) * 1000  # milliseconds
+    return {
+        "count": int(values.size),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p90": round(float(np.percentile(values, 90)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3)
+    }
+
+def stage_report(images, repeat):
+    samples = {stage: [] for stage in STAGES + ["total"]}
+    no_face = 0
+
+    for _ in range(repeat):
+        for filename, image_bytes in images:
+            timings, found = run_pipeline(filename, image_bytes, {})
+            if not found:
+                no_face += 1
+
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            samples["total"].append(sum(timings.values()))
+
+    return {stage: percentiles(values) for stage, values in samples.items()}, no_face
+
+def _worker_init():
+    face_model.load_model()
+
+def _worker_run(image):
+    run_pipeline(*image)
+    return 1
+
+def throughput_report(images, repeat, max_workers):
+    report = {}
+    jobs = [image for _ in range(repeat) for image in images]
+
+    for workers in range(1, max_workers + 1):
+        # Model loading happens in the initializer and one warm-up job per worker,
+        # both are excluded from the measured time
+        with Pool(workers, initializer=_worker_init) as pool:
+            pool.map(_worker_run, jobs[:workers], chunksize=1)
+
+            start = time.perf_counter()
+            done = sum(pool.map(_worker_run, jobs, chunksize=1))
+            elapsed = time.perf_counter() - start
+
+        report[workers] = round(done / elapsed, 2)
+
+    return report
+
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+def peak_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face-shape prediction pipeline")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "fixtures"), help="Folder with fixture images")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the fixture set")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Measure throughput for 1..N processes")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--output", help="Also write the JSON report to this file, e.g. to compare runs")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    start = time.perf_counter()
+    face_model.load_model()
+    load_seconds = time.perf_counter() - start
+    rss_after_load = peak_rss_mb(resource.RUSAGE_SELF)
+
+    # Warm up once so lazy initialisation inside dlib/sklearn is not measured
+    run_pipeline(*images[0])
+
+    stages, no_face = stage_report(images, args.repeat)
+    throughput = throughput_report(images, args.repeat, args.workers)
+
+    report = {
+        "images": len(images),
+        "repeat": args.repeat,
+        "no_face": no_face,
+        "model_load_seconds": round(load_seconds, 3),
+        "stages_ms": stages,
+        "throughput_per_second": throughput,
+        "peak_rss_mb": {
+            "after_model_load": rss_after_load,
+            "main": peak_rss_mb(resource.RUSAGE_SELF),
+            "largest_worker": peak_rss_mb(resource.RUSAGE_CHILDREN)
+        }
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{len(images)} images x {args.repeat} passes, {no_face} runs without a face")
+    print(f"Model load: {report['model_load_seconds']} s")
+    print(f"{'stage':<14}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, result in stages.items():
+        if result:
+            print(f"{stage:<14}{result['count']:>8}{result['p50']:>10}{result['p90']:>10}{result['p99']:>10}{result['max']:>10}")
+    print("Throughput (images/s):")
+    for workers, per_second in throughput.items():
+        print(f"  {workers} worker(s): {per_second}")
+    print(f"Peak RSS (MB): {report['peak_rss_mb']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Train the compact landmark predictor used by LANDMARK_BACKEND=compact.
+#
+# The predictor only learns the landmark points extract_features_from_landmarks reads
+# (app.model.FEATURE_LANDMARKS) with a shallower cascade, which makes the model file much
+# smaller and faster to load than the 68-point one. Optionally refits the scaler and the
+# classifier on features computed from the compact landmarks.
+#
+# Usage:
+#   python tools/train_compact_landmarks.py --training-xml ibug_300W/labels_ibug_300W_train.xml
+#   python tools/train_compact_landmarks.py --training-xml ... --labels faces.csv --base-model models/model.pkl
+#
+# faces.csv has one "image_path,face_shape" row per picture.
+from xml.etree import ElementTree
+import argparse
+import csv
+import os
+import sys
+import tempfile
+
+# The app modules create (lazy) Mongo clients on import, no server is contacted here
+os.environ.setdefault("MONGO_DB_NAME", "training")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import dlib
+import joblib
+
+from app import model as face_model
+
+# Rewrite a dlib/iBUG training XML so each box only keeps FEATURE_LANDMARKS, renumbered 0..N-1
+def write_compact_xml(source_xml, target_xml):
+    positions = {f"{index:02d}": n for n, index in enumerate(face_model.FEATURE_LANDMARKS)}
+    tree = ElementTree.parse(source_xml)
+
+    # Image paths in the XML are relative to the XML file
+    base_dir = os.path.dirname(os.path.abspath(source_xml))
+    for image in tree.getroot().iter("image"):
+        image.set("file", os.path.join(base_dir, image.get("file")))
+
+    for box in tree.getroot().iter("box"):
+        for part in list(box.findall("part")):
+            if part.get("name") in positions:
+                part.set("name", f"{positions[part.get('name')]:02d}")
+            else:
+                box.remove(part)
+
+    tree.write(target_xml)
+
+def train_predictor(args):
+    options = dlib.shape_predictor_training_options()
+    options.tree_depth = args.tree_depth
+    options.cascade_depth = args.cascade_depth
+    options.feature_pool_size = args.feature_pool_size
+    options.oversampling_amount = args.oversampling
+    options.nu = args.nu
+    options.num_threads = args.threads
+    options.be_verbose = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compact_xml = os.path.join(tmp, "compact_training.xml")
+        write_compact_xml(args.training_xml, compact_xml)
+        dlib.train_shape_predictor(compact_xml, args.output, options)
+
+    print(f"Compact predictor written to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+    if args.testing_xml:
+        with tempfile.TemporaryDirectory() as tmp:
+            compact_xml = os.path.join(tmp, "compact_testing.xml")
+            write_compact_xml(args.testing_xml, compact_xml)
+            print(f"Mean testing error: {dlib.test_shape_predictor(compact_xml, args.output):.3f}")
+
+# Refit scaler and classifier on features from the compact landmarks, keeping the
+# current classifier's type and hyperparameters
+def retrain_classifier(args):
+    from sklearn.base import clone
+    from sklearn.preprocessing import StandardScaler
+
+    detector = dlib.get_frontal_face_detector()
+    backend = face_model.CompactLandmarks(args.output)
+    features, labels = [], []
+
+    with open(args.labels, newline="") as f:
+        for image_path, face_shape in csv.reader(f):
+            img = cv2.imread(image_path)
+            if img is None:
+                print(f"Skipping unreadable image {image_path}")
+                continue
+
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            faces = detector(gray)
+            if len(faces) == 0:
+                print(f"Skipping {image_path}, no face detected")
+                continue
+
+            features.append(face_model.extract_features_from_landmarks(backend(gray, faces[0])))
+            labels.append(face_shape)
+
+    scaler = StandardScaler().fit(features)
+    classifier = clone(joblib.load(args.base_model)).fit(scaler.transform(features), labels)
+
+    joblib.dump(scaler, args.scaler_output)
+    joblib.dump(classifier, args.model_output)
+    print(f"Scaler and model trained on {len(labels)} faces: {args.scaler_output}, {args.model_output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the compact landmark predictor")
+    parser.add_argument("--training-xml", required=True, help="dlib/iBUG 68-point training XML")
+    parser.add_argument("--testing-xml", help="Optional 68-point testing XML to report the error")
+    parser.add_argument("--output", default=face_model.CompactLandmarks.default_path)
+    parser.add_argument("--tree-depth", type=int, default=4)
+    parser.add_argument("--cascade-depth", type=int, default=10)
+    parser.add_argument("--feature-pool-size", type=int, default=400)
+    parser.add_argument("--oversampling", type=int, default=20)
+    parser.add_argument("--nu", type=float, default=0.1)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--labels", help="CSV of image_path,face_shape to retrain scaler and model")
+    parser.add_argument("--base-model", default="models/model.pkl", help="Classifier whose type and parameters are reused")
+    parser.add_argument("--scaler-output", default="models/compact/scaler.pkl")
+    parser.add_argument("--model-output", default="models/compact/model.pkl")
+    args = parser.parse_args()
+
+    train_predictor(args)
+
+    if args.labels:
+        os.makedirs(os.path.dirname(args.scaler_output), exist_ok=True)
+        os.makedirs(os.path.dirname(args.model_output), exist_ok=True)
+        retrain_classifier(args)
+
+if __name__ == "__main__":
+    main()